@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""
+Benchmark: bench.py
+
+Microbenchmarks of the library's CPU hot paths. No network access is
+needed: the HTTP layer is replaced with canned responses shaped like
+the ones returned by the Scribd API.
+
+Every benchmark runs in a forked child process (on systems supporting
+fork) so the reported peak memory usage belongs to that benchmark only.
+
+Usage:
+
+    python benchmarks/bench.py [--filter TEXT] [--min-time SECONDS]
+                               [--json FILE] [--compare FILE]
+
+The --json option appends the results to a file, one JSON object per
+line, and --compare prints the change relative to results saved earlier.
+"""
+
+import os
+import sys
+import time
+from cStringIO import StringIO
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scribd
+from scribd import multipart, xmlparse
+
+
+#
+# Canned API responses
+#
+
+def getlist_xml(count):
+    """Returns a docs.getList response with "count" results."""
+    results = []
+    for i in xrange(count):
+        results.append('''
+    <result>
+      <doc_id type="integer">%d</doc_id>
+      <title><![CDATA[Annual report %d]]></title>
+      <description><![CDATA[Financial statements and notes for the year, part %d.]]></description>
+      <access_key>key-%016x</access_key>
+      <secret_password>%012x</secret_password>
+      <conversion_status>DONE</conversion_status>
+      <page_count type="integer">%d</page_count>
+      <thumbnail_url>http://i.scribd.com/public/images/uploaded/%d/thumb.jpg</thumbnail_url>
+      <tags><![CDATA[report,finance,annual]]></tags>
+      <reads type="integer">%d</reads>
+    </result>''' % (1000000 + i, i, i, i, i, 1 + i % 300, i, i * 7))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<rsp stat="ok">\n'
+            '  <resultset list="true">%s\n  </resultset>\n</rsp>\n' % ''.join(results))
+
+
+class CannedResponse(object):
+    """Stands in for the multipart.Response object."""
+
+    def __init__(self, body):
+        self.status = 200
+        self.body = body
+        self._fp = StringIO(body)
+
+    def getheader(self, name, default=None):
+        if name.lower() == 'content-type':
+            return 'application/xml'
+        return default
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._fp.read()
+        return self._fp.read(amt)
+
+
+def install_canned(body):
+    """Replaces the HTTP layer so that every API call returns "body"."""
+    def post_multipart(host, selector, fields=(), headers=None, port=None, pool=None,
+                       connect_timeout=None, read_timeout=None):
+        return CannedResponse(body)
+    scribd.post_multipart = post_multipart
+
+
+#
+# Benchmarks
+#
+# Every benchmark function prepares the data and returns a (function,
+# units) tuple. The function is timed; "units" is the number of items
+# (fields, results, documents, bytes) it processes per call.
+#
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS.append((name, function))
+        return function
+    return register
+
+
+def _documents(count):
+    xml = xmlparse.parse(getlist_xml(count))
+    return [scribd.Document(result, scribd.api_user) for result in xml.get('resultset')]
+
+
+@benchmark('encode_fields')
+def bench_encode_fields():
+    fields = dict(doc_id=1234567, title=u'Annual report \u2013 2009', access='private',
+                  show_ads=True, license='c', tags='report,finance', session_key=None)
+    def run():
+        scribd.encode_fields('docs.changeSettings', fields)
+    return run, len(fields)
+
+
+@benchmark('sign')
+def bench_sign():
+    fields = {'method': 'docs.getList', 'api_key': scribd.api_key, 'limit': '100',
+              'offset': '0', 'session_key': 'abcdef0123456789'}
+    def run():
+        scribd.sign(fields)
+    return run, len(fields)
+
+
+@benchmark('multipart.small')
+def bench_multipart_small():
+    fields = [('method', 'docs.getList'), ('api_key', 'k' * 24), ('limit', '100'),
+              ('api_sig', 'f' * 32)]
+    def run():
+        multipart.encode_multipart_formdata(fields, '----------boundary----------')
+    return run, len(fields)
+
+
+@benchmark('multipart.large')
+def bench_multipart_large():
+    data = 'x' * (4 * 1024 * 1024)
+    fields = [('method', 'docs.upload'), ('api_key', 'k' * 24),
+              ('file', (data, 'report.pdf')), ('api_sig', 'f' * 32)]
+    def run():
+        multipart.encode_multipart_formdata(fields, '----------boundary----------')
+    return run, len(data)
+
+
+@benchmark('multipart.stream')
+def bench_multipart_stream():
+    file = StringIO('x' * (4 * 1024 * 1024))
+    fields = [('method', 'docs.upload'), ('api_key', 'k' * 24),
+              ('file', (file, 'report.pdf')), ('api_sig', 'f' * 32)]
+    def run():
+        file.seek(0)
+        parts, length = multipart.encode_multipart_parts(fields, '----------boundary----------')
+        for block in multipart.iter_multipart_parts(parts):
+            pass
+    return run, 4 * 1024 * 1024
+
+
+def _parse_benchmark(count):
+    data = getlist_xml(count)
+    def run():
+        for result in xmlparse.parse(data).get('resultset'):
+            for element in result:
+                element.text
+    return run, count
+
+for _count in (10, 100, 1000):
+    benchmark('xmlparse.parse.%d' % _count)(lambda count=_count: _parse_benchmark(count))
+
+
+@benchmark('resource.load_attributes')
+def bench_load_attributes():
+    results = list(xmlparse.parse(getlist_xml(1000)).get('resultset'))
+    def run():
+        for result in results:
+            scribd.Document(result, scribd.api_user)
+    return run, len(results)
+
+
+@benchmark('resource.load_fields')
+def bench_load_attributes_fields():
+    results = list(xmlparse.parse(getlist_xml(1000)).get('resultset'))
+    fields = ('title', 'page_count')
+    def run():
+        for result in results:
+            scribd.Document(result, scribd.api_user, fields)
+    return run, len(results)
+
+
+@benchmark('resource.getattr')
+def bench_getattr():
+    docs = _documents(1000)
+    def run():
+        for doc in docs:
+            doc.doc_id, doc.title, doc.conversion_status, doc.page_count
+    return run, len(docs) * 4
+
+
+@benchmark('resource.getattr.dynamic')
+def bench_getattr_dynamic():
+    docs = _documents(1000)
+    for doc in docs:
+        doc._attributes['rating'] = 4.5
+    def run():
+        for doc in docs:
+            doc.rating
+    return run, len(docs)
+
+
+@benchmark('resource.setattr')
+def bench_setattr():
+    docs = _documents(1000)
+    def run():
+        for doc in docs:
+            doc.title = 'New title'
+            doc.access = 'private'
+    return run, len(docs) * 2
+
+
+@benchmark('update.10000')
+def bench_update():
+    install_canned('<?xml version="1.0"?><rsp stat="ok"></rsp>')
+    docs = _documents(1000) * 10
+    # Alternated so every run changes the documents; repeating the same
+    # values would be skipped as no-ops after the first run.
+    values = [('private', 'report'), ('public', 'summary')]
+    turn = [0]
+    def run():
+        turn[0] ^= 1
+        access, tags = values[turn[0]]
+        scribd.update(docs, access=access, tags=tags)
+    return run, len(docs)
+
+
+@benchmark('send_request.getList.100')
+def bench_send_request():
+    install_canned(getlist_xml(100))
+    def run():
+        scribd.api_user.all(limit=100)
+    return run, 100
+
+
+#
+# Runner
+#
+
+def measure(function, units, min_time):
+    """Returns the best number of seconds per call out of three rounds,
+    each lasting at least "min_time" seconds.
+    """
+    best = None
+    for round in xrange(3):
+        calls = 0
+        start = time.time()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.time() - start
+            if elapsed >= min_time:
+                break
+        per_call = elapsed / calls
+        if best is None or per_call < best:
+            best = per_call
+    return best
+
+
+def run_benchmark(name, setup, min_time):
+    function, units = setup()
+    function() # Warm up.
+    per_call = measure(function, units, min_time)
+    return {'name': name,
+            'sec_per_call': per_call,
+            'calls_per_sec': 1.0 / per_call,
+            'units_per_sec': units / per_call}
+
+
+def run_isolated(name, setup, min_time):
+    """Runs a benchmark in a forked child process and adds the child's
+    peak memory usage (in KB) to the results.
+    """
+    if not hasattr(os, 'fork') or not hasattr(os, 'wait4'):
+        result = run_benchmark(name, setup, min_time)
+        result['peak_rss_kb'] = None
+        return result
+    import json
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        code = 0
+        try:
+            try:
+                result = run_benchmark(name, setup, min_time)
+                os.write(write, json.dumps(result))
+            except:
+                import traceback
+                traceback.print_exc()
+                code = 1
+        finally:
+            os._exit(code)
+    os.close(write)
+    chunks = []
+    while True:
+        data = os.read(read, 65536)
+        if not data:
+            break
+        chunks.append(data)
+    os.close(read)
+    pid, status, usage = os.wait4(pid, 0)
+    if status != 0:
+        raise RuntimeError('benchmark %s failed' % name)
+    result = json.loads(''.join(chunks))
+    result['peak_rss_kb'] = usage.ru_maxrss
+    return result
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--filter', default='',
+                      help='run only benchmarks whose names contain TEXT')
+    parser.add_option('--min-time', type='float', default=0.2,
+                      help='minimal duration of a measurement round in seconds')
+    parser.add_option('--json', metavar='FILE',
+                      help='append the results to FILE as JSON lines')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare with the last results stored in FILE')
+    options, args = parser.parse_args()
+
+    import json
+    previous = {}
+    if options.compare:
+        for line in open(options.compare):
+            if line.strip():
+                result = json.loads(line)
+                previous[result['name']] = result
+
+    scribd.config('0123456789abcdef01234567', 'fedcba9876543210fedcba98')
+
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    results = []
+    sys.stdout.write('%-28s %14s %16s %12s\n' % ('benchmark', 'us/call', 'units/s', 'peak KB'))
+    for name, setup in BENCHMARKS:
+        if options.filter not in name:
+            continue
+        result = run_isolated(name, setup, options.min_time)
+        result['time'] = stamp
+        result['python'] = sys.version.split()[0]
+        results.append(result)
+        line = '%-28s %14.2f %16.0f %12s' % (name, result['sec_per_call'] * 1e6,
+                                             result['units_per_sec'],
+                                             result['peak_rss_kb'] or '-')
+        if name in previous:
+            change = result['sec_per_call'] / previous[name]['sec_per_call'] - 1.0
+            line += ' %+7.1f%%' % (change * 100.0)
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    if options.json:
+        file = open(options.json, 'a')
+        try:
+            for result in results:
+                file.write(json.dumps(result, sort_keys=True) + '\n')
+        finally:
+            file.close()
+
+
+if __name__ == '__main__':
+    main()
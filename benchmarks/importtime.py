@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Benchmark: importtime.py
+
+Measures the cold start cost of "import scribd".
+
+The import is repeated in fresh interpreter processes and the best and
+median wall-clock times are reported together with the list of modules
+the import pulls in. If the interpreter supports the "-X importtime"
+option (Python 3.7+), the cumulative import time of every module is
+reported as well.
+
+Usage:
+
+    python benchmarks/importtime.py [--runs N] [--python PATH] [--json]
+"""
+
+import os
+import re
+import sys
+import subprocess
+from optparse import OptionParser
+
+
+# Executed in the child processes. Prints the import time and the names
+# of the modules imported by "import scribd".
+CHILD = '''
+import sys, time
+before = set(sys.modules)
+start = time.time()
+import scribd
+elapsed = time.time() - start
+sys.stdout.write('%r\\n' % elapsed)
+sys.stdout.write(' '.join(sorted(m for m in set(sys.modules) - before
+                                 if sys.modules[m] is not None)) + '\\n')
+'''
+
+_importtime_re = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def run_child(python, env, options=()):
+    args = [python] + list(options) + ['-c', CHILD]
+    proc = subprocess.Popen(args, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('child process failed:\n%s' % err.decode('utf8', 'replace'))
+    lines = out.decode('ascii').splitlines()
+    return float(lines[0]), lines[1].split(), err.decode('utf8', 'replace')
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=20,
+                      help='number of measured imports (default 20)')
+    parser.add_option('--python', default=sys.executable,
+                      help='interpreter to measure (default: current one)')
+    parser.add_option('--json', action='store_true',
+                      help='print the results as a JSON object')
+    options, args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in
+                                         [env.get('PYTHONPATH')] if p])
+
+    # Warm up the OS file cache and compile the .pyc files.
+    run_child(options.python, env)
+
+    times = []
+    for i in range(options.runs):
+        elapsed, modules, err = run_child(options.python, env)
+        times.append(elapsed)
+    times.sort()
+
+    cumulative = {}
+    try:
+        elapsed, modules, err = run_child(options.python, env, ['-X', 'importtime'])
+    except RuntimeError:
+        pass # Option not supported.
+    else:
+        for line in err.splitlines():
+            match = _importtime_re.match(line)
+            if match:
+                cumulative[match.group(4)] = int(match.group(2))
+
+    results = {'python': options.python,
+               'runs': options.runs,
+               'best_ms': times[0] * 1000.0,
+               'median_ms': times[len(times) // 2] * 1000.0,
+               'modules': modules,
+               'cumulative_us': cumulative}
+
+    if options.json:
+        import json
+        sys.stdout.write(json.dumps(results, sort_keys=True) + '\n')
+        return
+
+    sys.stdout.write('import scribd: best %.2f ms, median %.2f ms (%d runs)\n' %
+                     (results['best_ms'], results['median_ms'], options.runs))
+    sys.stdout.write('modules imported (%d): %s\n' % (len(modules), ' '.join(modules)))
+    if cumulative:
+        sys.stdout.write('cumulative import time (-X importtime):\n')
+        items = sorted(cumulative.items(), key=lambda item: -item[1])
+        for name, us in items[:15]:
+            sys.stdout.write('  %8d us  %s\n' % (us, name))
+
+
+if __name__ == '__main__':
+    main()
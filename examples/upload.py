@@ -4,7 +4,6 @@ Example: upload.py
 Uploading a text file to scribd.com and removing it afterwards.
 """
 
-import time
 import logging
 
 import scribd
@@ -31,12 +30,12 @@ def main():
         doc = scribd.api_user.upload(open('test.txt'))
         print 'Done (doc_id=%s, access_key=%s).' % (doc.id, doc.access_key)
         
-        # Poll API until conversion is complete.
-        while doc.get_conversion_status() != 'DONE':
-            print 'Document conversion is processing...'
-            # Sleep to prevent a runaway loop that will block the script.
-            time.sleep(2)
-        print 'Document conversion is complete.'
+        # Wait until conversion is complete. The function polls the API
+        # less and less often, so it won't become a runaway loop.
+        print 'Document conversion is processing...'
+        for doc in scribd.wait_for_conversion([doc]):
+            print 'Document conversion is complete (status=%s).' % \
+                doc.conversion_status
         
         # Edit various document options.
         # (Note that the options may also be changed during the conversion)
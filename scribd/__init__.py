@@ -19,29 +19,36 @@ accompanying LICENSE file for more information.
 
 __version__ = '1.1.0'
 
-__all__ = ['NotReadyError', 'MalformedResponseError', 'ResponseError',
+__all__ = ['NotReadyError', 'TimeoutError', 'MalformedResponseError', 'ResponseError',
            'Resource', 'User', 'VirtualUser', 'Document', 'login',
-           'signup', 'update', 'find', 'xfind', 'config', 'api_user']
+           'signup', 'update', 'find', 'xfind', 'wait_for_conversion',
+           'upload_many', 'download_many', 'fetch_thumbnails',
+           'secure_embed_params_many', 'set_access_many', 'revoke_all',
+           'PageSizer', 'priority', 'deadline', 'config', 'api_user']
            
 
 #
 # Imports
 #
+# Modules that take long to import (hashlib, httplib, xml.dom) are
+# imported on first use to keep "import scribd" fast.
+#
 
 import sys
 import logging
 import os
-from time import time
-
-# Both md5 module (deprecated since Python 2.5) and hashlib provide the
-# same md5 object.
-if sys.version_info >= (2, 5):
-    from hashlib import md5
-else:
-    from md5 import md5
+import threading
+import weakref
+from time import time, sleep
 
-from scribd.multipart import post_multipart
+from scribd import multipart
+from scribd.multipart import post_multipart, ConnectionPool
 from scribd import xmlparse
+from scribd import forksafe
+from scribd import metrics
+from scribd import profiler
+from scribd import tasks
+from scribd.tasks import INTERACTIVE, BACKGROUND, priority, deadline
 
 
 #
@@ -55,6 +62,60 @@ PORT = 80
 # Scribd HTTP API request path.
 REQUEST_PATH = '/api'
 
+# Number of seconds to wait for a connection to the HOST to be opened
+# and for every following socket operation of a request. None means
+# no limit. The time limit of a whole call is set by its "timeout"
+# argument or the deadline() context manager.
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+
+# Conversion statuses after which a document's status no longer changes.
+CONVERSION_FINISHED = ('DONE', 'ERROR')
+
+# Number of documents per docs.getList call used by wait_for_conversion()
+# to read the statuses of many documents at once.
+STATUS_PAGE_SIZE = 1000
+
+# Read-only API methods whose identical concurrent calls are coalesced:
+# while a call is in progress, the same calls made by other threads wait
+# for it and share its response. Make it empty to disable coalescing.
+COALESCED_METHODS = frozenset(['docs.getList', 'docs.search', 'docs.getSettings',
+                               'docs.getConversionStatus', 'docs.getDownloadUrl',
+                               'security.getUserAccessList',
+                               'security.getDocumentAccessList'])
+
+# Read-only API methods whose slow calls are hedged if the hedger is set.
+HEDGED_METHODS = COALESCED_METHODS
+
+# Limit of the API call rate shared by all threads. Set to
+# a scribd.tasks.RateLimiter object taking calls, for example
+# RateLimiter(5) for 5 calls per second. Retried requests count too.
+call_limiter = None
+
+# Scheduler of the API requests by priority (INTERACTIVE or BACKGROUND,
+# see priority()). Set to a scribd.tasks.Scheduler object to enable, for
+# example Scheduler(slots=10, rate=5, background_share=0.2).
+scheduler = None
+
+# Hedging of the slow calls of HEDGED_METHODS: if a response doesn't come
+# in time, an identical request is sent on another connection and the
+# first response is used. Set to a scribd.tasks.Hedger object to enable,
+# for example Hedger(percentile=95, max_extra=0.05).
+hedger = None
+
+# Limit of the upload bandwidth shared by all threads. Set to
+# a scribd.tasks.RateLimiter object taking bytes, for example
+# RateLimiter(512 * 1024) for 512 KB/s.
+upload_limiter = None
+
+# Local full-text index of the users' documents used by [User].find()
+# with local=True. Set to a scribd.textindex.TextIndex object to enable.
+text_index = None
+
+# Index of the uploaded data used to skip redundant uploads. Set to
+# a scribd.dedup.DedupIndex object to enable.
+dedup_index = None
+
 # API key and secret as given by Scribd after registering for an API account.
 # Set both after importing, either directly or using the config() function.
 api_key = ''
@@ -81,6 +142,10 @@ class NotReadyError(Error):
         Exception.__init__(self, str(message))
 
 
+class TimeoutError(NotReadyError):
+    """Exception raised if an API call doesn't finish before its deadline."""
+
+
 class MalformedResponseError(Error):
     """Exception raised if a malformed response is received from the HOST."""
     
@@ -117,6 +182,45 @@ class NullHandler(logging.Handler):
         pass
 
 
+class _ResourceAttribute(object):
+    # Descriptor of a known resource attribute. Reads the attribute
+    # without going through Resource.__getattr__() and sets it without
+    # the name checks of Resource.__setattr__().
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        name = self.name
+        set_attributes = obj._set_attributes
+        if set_attributes and name in set_attributes:
+            return set_attributes[name]
+        attributes = obj._attributes
+        if name in attributes:
+            return attributes[name]
+        # Let Resource.__getattr__() report the error.
+        raise AttributeError(name)
+
+    def __set__(self, obj, value):
+        obj._set_attributes[self.name] = value
+
+
+# Sets an instance variable without calling Resource.__setattr__().
+_set_slot = object.__setattr__
+
+
+def _define_attributes(cls, names):
+    # Adds descriptors of the known resource attributes to the class.
+    # Other resource attributes are still accessible, only slower.
+    for name in names:
+        setattr(cls, name, _ResourceAttribute(name))
+    cls._known_attributes = cls._known_attributes.union(names)
+
+
 class Resource(object):
     """Base class for remote objects that the Scribd API allows
     to interact with.
@@ -127,42 +231,78 @@ class Resource(object):
     stored and managed by the Scribd platform. They are accessed
     and used like any other Python object attributes but are
     stored in a separate container.
+
+    The instance variables are declared using __slots__. Subclasses
+    should declare theirs too. Otherwise, like with the attributes of
+    subclasses without __slots__, the instance variables have to be
+    set before Resource.__init__() is called; all attributes set later
+    are treated as resource attributes.
     """
 
-    def __init__(self, xml=None):
+    __slots__ = ('_attributes', '_set_attributes', '_fields', '__weakref__')
+
+    # Names of the resource attributes with descriptors.
+    _known_attributes = frozenset()
+
+    def __init__(self, xml=None, fields=None):
         # Instantiates an object of the class.
         #
         # If "xml" is not None, it is a xmlparse.Element object whose
         # subelements are to be converted to this object's resource
-        # attributes.
+        # attributes. If "fields" is not None, only the subelements
+        # named in it are converted.
 
-        self._attributes = {} # Attributes as loaded from the XML.
-        self._set_attributes = {} # Attributes set externally.
-
-        # Create a list of instance variables. All variables used by
-        # the object during its lifetime have to be setup at this point.
-        # This is used to distinguish between instance variables and
-        # the resource attributes.
-        self._instance_vars_names = self.__dict__.keys()
+        # The slots are set directly, bypassing __setattr__(), because
+        # many objects are created when listings are loaded.
+        _set_slot(self, '_attributes', {}) # Attributes as loaded from the XML.
+        _set_slot(self, '_set_attributes', {}) # Attributes set externally.
+        _set_slot(self, '_fields', None) # Names of the loaded attributes if limited.
 
         if xml is not None:
-            self._load_attributes(xml)
+            self._load_attributes(xml, fields)
             
     def get_attributes(self):
         """Returns a dictionary with the resource attributes."""
         attrs = self._attributes.copy()
         attrs.update(self._set_attributes)
         return attrs
+
+    def _get_changes(self, fields=None):
+        """Returns a dictionary with the attributes from "fields" (defaults
+        to the attributes set externally) whose values differ from the
+        loaded ones. The values are compared as they would be sent to
+        the HOST, so for example 1, '1' and True are all equal.
+        """
+        if fields is None:
+            fields = self._set_attributes
+        changes = {}
+        for name, value in fields.items():
+            try:
+                current = self._attributes[name]
+            except KeyError:
+                changes[name] = value
+                continue
+            if _encode_value(value) != _encode_value(current):
+                changes[name] = value
+        return changes
+
+    def _store_attributes(self, fields):
+        """Stores saved attribute values as the loaded ones."""
+        for name, value in fields.items():
+            self._attributes[name] = value
+            self._set_attributes.pop(name, None)
         
     def _send_request(self, method, **fields):
         """Sends a request to the HOST and returns the XML response."""
         return send_request(method, **fields)
         
-    def _load_attributes(self, xml):
+    def _load_attributes(self, xml, fields=None):
         """Adds resource attributes to this object based on XML
-        response from the HOST.
+        response from the HOST. If "fields" is not None, only the
+        attributes named in it are added.
         """
-        for element in xml:
+        _set_slot(self, '_fields', fields)
+        for element in xml.iter(fields):
             text = element.text
             if text is not None:
                 try:
@@ -179,31 +319,50 @@ class Resource(object):
             self._set_attributes.pop(element.name, None)
             
     def __getattr__(self, name):
-        # The attribute is treated as a resource attribute if
-        # self._instance_vars_names is defined and it doesn't
-        # contain the attribute name.
-        if name not in self.__dict__.get('_instance_vars_names', (name,)):
-            if name == 'id':
-                return self._get_id()
-            try:
-                return self._set_attributes[name]
-            except KeyError:
-                pass
-            try:
-                return self._attributes[name]
-            except KeyError:
-                pass
+        # Called if the name isn't a class attribute, instance variable
+        # or a known resource attribute. Looks up the other resource
+        # attributes once the object is initialized.
+        if name not in _RESOURCE_SLOTS and name[:2] != '__' and \
+                hasattr(self, '_set_attributes'):
+            set_attributes = self._set_attributes
+            if name in set_attributes:
+                return set_attributes[name]
+            attributes = self._attributes
+            if name in attributes:
+                return attributes[name]
+            fields = self._fields
+            if fields is not None and name not in fields:
+                raise AttributeError('%s attribute %s was not loaded (not in fields), '
+                                     'use load() to load all attributes' % \
+                                     (repr(self.__class__.__name__), repr(name)))
         raise AttributeError('%s object has no attribute %s' % \
                              (repr(self.__class__.__name__), repr(name)))
             
     def __setattr__(self, name, value):
-        # The attribute is treated as a resource attribute if
-        # self._instance_vars_names is defined and it doesn't
-        # contain the attribute name.
-        if name in self.__dict__.get('_instance_vars_names', (name,)):
-            object.__setattr__(self, name, value)         
-        else:
+        # Names defined by the class (slots, properties) are set normally.
+        # Other names are resource attributes, unless the object isn't
+        # initialized yet or already has an instance variable of that
+        # name in its __dict__ (subclasses without __slots__).
+        if name in self._known_attributes:
             self._set_attributes[name] = value
+            return
+        if hasattr(self.__class__, name):
+            object.__setattr__(self, name, value)
+            return
+        try:
+            set_attributes = self._set_attributes
+        except AttributeError:
+            object.__setattr__(self, name, value)
+            return
+        if name in getattr(self, '__dict__', ()):
+            object.__setattr__(self, name, value)
+        else:
+            set_attributes[name] = value
+
+    def id(self):
+        """Identifier of the object."""
+        return self._get_id()
+    id = property(id)
 
     def __repr__(self):
         return '<%s.%s %s at 0x%x>' % (self.__class__.__module__,
@@ -222,6 +381,10 @@ class Resource(object):
         return ''
 
 
+# Instance variables of all resources.
+_RESOURCE_SLOTS = frozenset(Resource.__slots__)
+
+
 class User(Resource):
     """Represents a Scribd user.
 
@@ -231,6 +394,8 @@ class User(Resource):
         Refer to "Result explanation" section of:
         http://www.scribd.com/developers/api?method_name=user.login
     """
+
+    __slots__ = ()
     
     def _send_request(self, method, **fields):
         """Sends a request to the HOST and returns the XML response."""
@@ -249,6 +414,17 @@ class User(Resource):
             Note. Parameters "api_key", "api_sig", "session_key", "my_user_id"
             are managed internally by the library.
           
+        Additional parameters:
+          fields
+            (optional) A sequence of names of the resource attributes to
+            keep. Other attributes are dropped while the response is
+            parsed, which saves memory if many documents are kept. The
+            "doc_id" attribute is always kept. Use [Document].load() to
+            load all attributes later.
+          timeout
+            (optional) Maximal number of seconds the call may take. Refer
+            to the send_request() function.
+
         Returns:
             A list of [Document] objects.
 
@@ -256,8 +432,11 @@ class User(Resource):
             http://www.scribd.com/developers/api?method_name=docs.getList
             for a list of document's initial resource attributes.
         """
+        fields = _projection(kwargs.pop('fields', None))
         xml = self._send_request('docs.getList', **kwargs)
-        return [Document(result, self) for result in xml.get('resultset')]
+        docs = [Document(result, self, fields) for result in xml.get('resultset')]
+        profiler.built(xml)
+        return docs
 
     def xall(self, **kwargs):
         """Similar to all() method but returns a generator object
@@ -275,7 +454,14 @@ class User(Resource):
           page_size
             (optional) The number of documents acquired by a single API
             call. The generator repeats the calls until all documents are
-            returned. Defaults to 100.
+            returned. Defaults to 100. May be a [PageSizer] object adapting
+            the size to the response times or 'auto' for a default one.
+          fields
+            (optional) Names of the resource attributes to keep. Refer to
+            the all() method.
+          timeout
+            (optional) Maximal number of seconds all the calls may take.
+            If the time runs out, the generator raises TimeoutError.
 
         Returns:
             A generator object yielding [Document] objects.
@@ -287,23 +473,39 @@ class User(Resource):
         Note. If you're not interested in all documents (currently there
         may be max. 1000 of them), just stop iterating the generator object.
         """
-        kwargs['limit'] = kwargs.pop('page_size', 100)
+        sizer = _page_sizer(kwargs.pop('page_size', 100))
+        fields = _projection(kwargs.pop('fields', None))
+        end = _deadline(kwargs.pop('timeout', None))
         while True:
+            kwargs['limit'] = sizer.page_size
+            if end is not None:
+                kwargs['timeout'] = end - time()
+            start = time()
             xml = self._send_request('docs.getList', **kwargs)
+            elapsed = time() - start
             results = xml.get('resultset')
-            for result in results:
-                yield Document(result, self)
+            docs = [Document(result, self, fields) for result in results]
+            profiler.built(xml)
+            sizer.observe(kwargs['limit'], len(results), elapsed, xml.size)
+            for doc in docs:
+                yield doc
             if len(results) < kwargs['limit']:
                 break
             kwargs['offset'] = kwargs.get('offset', 0) + len(results)
 
-    def get(self, doc_id):
+    def get(self, doc_id, fields=None, timeout=None):
         """Returns a document with the specified id.
         
         Parameters:
           doc_id
             (required) Identifier of the document to be returned.
             The user has to be the owner of this document.
+          fields
+            (optional) Names of the resource attributes to keep. Refer to
+            the all() method.
+          timeout
+            (optional) Maximal number of seconds the call may take. Refer
+            to the send_request() function.
 
         Returns:
             A [Document] object.
@@ -312,8 +514,10 @@ class User(Resource):
             http://www.scribd.com/developers/api?method_name=docs.getSettings
             for a list of document's initial resource attributes.
         """
-        xml = self._send_request('docs.getSettings', doc_id=doc_id)
-        return Document(xml, self)
+        xml = self._send_request('docs.getSettings', doc_id=doc_id, timeout=timeout)
+        doc = Document(xml, self, _projection(fields))
+        profiler.built(xml)
+        return doc
 
     def find(self, query, **kwargs):
         """Searches for documents and returns a list of them.
@@ -332,6 +536,17 @@ class User(Resource):
           limit
             (optional) The number of documents to return
             (default 10, max 1000).
+          fields
+            (optional) Names of the resource attributes to keep. Refer to
+            the all() method.
+          local
+            (optional) If True and scribd.text_index has the documents of
+            this user indexed, the search is performed locally, without an
+            API call. Refer to the scribd.textindex module for the query
+            syntax. The "scope" parameter has to be 'user' (the default).
+          timeout
+            (optional) Maximal number of seconds the call may take. Refer
+            to the send_request() function.
 
         Note on the "scope" parameter:
             Only if scope=='user', the returned documents will have the
@@ -351,11 +566,28 @@ class User(Resource):
         """
         kwargs['num_results'] = kwargs.pop('limit', None)
         kwargs['num_start'] = kwargs.pop('offset', None)
+        fields = _projection(kwargs.pop('fields', None))
+        if kwargs.pop('local', False) and text_index is not None and \
+                kwargs.get('scope', 'user') == 'user':
+            results = text_index.search(self, query, kwargs['num_start'] or 0,
+                                        kwargs['num_results'] or 10)
+            metrics.cache('text_index', results is not None)
+            if results is not None:
+                docs = []
+                for attrs in results:
+                    doc = Document(None, self, fields)
+                    if fields is not None:
+                        attrs = dict((k, v) for k, v in attrs.items() if k in fields)
+                    doc._attributes.update(attrs)
+                    docs.append(doc)
+                return docs
         xml = self._send_request('docs.search', query=query, **kwargs)
         owner = api_user
         if kwargs.get('scope', 'user') == 'user':
             owner = self
-        return [Document(result, owner) for result in xml.get('result_set')]
+        docs = [Document(result, owner, fields) for result in xml.get('result_set')]
+        profiler.built(xml)
+        return docs
 
     def xfind(self, query, **kwargs):
         """Similar to find() method but returns a generator object searching
@@ -375,6 +607,14 @@ class User(Resource):
           page_size
             (optional) The number of documents acquired by a single API
             call. The calls are repeated until all documents are returned.
+            May be a [PageSizer] object adapting the size to the response
+            times or 'auto' for a default one.
+          fields
+            (optional) Names of the resource attributes to keep. Refer to
+            the all() method.
+          timeout
+            (optional) Maximal number of seconds all the calls may take.
+            Refer to the xall() method.
 
         Returns:
             A generator object yielding [Document] objects.
@@ -386,22 +626,36 @@ class User(Resource):
         Note. If you're not interested in all documents (currently there
         may be max. 1000 of them), just stop iterating the generator object.
         """
-        kwargs['num_results'] = kwargs.get('page_size', None) 
+        sizer = kwargs.pop('page_size', None)
+        if sizer is not None:
+            sizer = _page_sizer(sizer)
         kwargs['num_start'] = kwargs.get('offset', None)
+        fields = _projection(kwargs.pop('fields', None))
         owner = api_user
         if kwargs.get('scope', 'user') == 'user':
             owner = self
+        end = _deadline(kwargs.pop('timeout', None))
         while True:
+            if sizer is not None:
+                kwargs['num_results'] = sizer.page_size
+            if end is not None:
+                kwargs['timeout'] = end - time()
+            start = time()
             xml = self._send_request('docs.search', query=query, **kwargs)
+            elapsed = time() - start
             results = xml.get('result_set')
-            for result in results:
-                yield Document(result, owner)
+            docs = [Document(result, owner, fields) for result in results]
+            profiler.built(xml)
+            if sizer is not None:
+                sizer.observe(kwargs['num_results'], len(results), elapsed, xml.size)
+            for doc in docs:
+                yield doc
             kwargs['num_start'] = int(results.attrs['firstResultPosition']) + \
                                   int(results.attrs['totalResultsReturned']) - 1
             if kwargs['num_start'] >= int(results.attrs['totalResultsAvailable']):
                 break
 
-    def upload(self, file, name=None, **kwargs):
+    def upload(self, file, name=None, progress=None, **kwargs):
         """Uploads a file as a new document and returns the corresponding
         [Document] object.
         
@@ -414,7 +668,9 @@ class User(Resource):
             documented below.
 
           file
-            (required) File-alike object to upload. The file is loaded
+            (required) File-alike object to upload. If the object supports
+            the seek() and tell() methods, the file is streamed to the HOST
+            from its current position in blocks. Otherwise it is loaded
             into memory using the read() method and uploaded.
           name
             (optional) Name of the file. Either a full path or just the
@@ -422,6 +678,10 @@ class User(Resource):
             existing file. If None, the name will be read from the "name"
             attribute of the file object (objects created using the open()
             built-in function provide this attribute).
+          progress
+            (optional) A callable called while the file is being sent with
+            the number of bytes sent, the total number of bytes and the
+            rate in bytes per second.
 
         Returns:
             A [Document] object.
@@ -429,6 +689,13 @@ class User(Resource):
             Refer to "Result explanation" section of:
             http://www.scribd.com/developers/api?method_name=docs.upload
             for a list of document's initial resource attributes.
+
+        If scribd.dedup_index is set and this user has already uploaded the
+        same data with the same parameters, the file is not uploaded and the
+        existing document is returned instead. The same applies to the
+        revisions (the "rev_id" parameter) identical to the current document
+        data and parameters. Data uploaded with different parameters (for
+        example a different "access") is always uploaded.
         """
         if name is None:
             name = file.name
@@ -436,8 +703,51 @@ class User(Resource):
         if 'doc_type' not in kwargs:
             kwargs['doc_type'] = os.path.splitext(name)[-1]
         kwargs['doc_type'] = kwargs['doc_type'].lstrip('.').lower()
-        xml = self._send_request('docs.upload', file=(file.read(), name), **kwargs)
-        return Document(xml, self)
+        rev_id = kwargs.get('rev_id', None)
+        index = dedup_index
+        digest = None
+        if index is not None:
+            # The parameters the document is converted with are a part of
+            # the digest. The call options and the revision target aren't.
+            params = dict((k, v) for k, v in kwargs.items()
+                          if k not in ('rev_id', 'priority', 'timeout'))
+            digest = index.digest(file, params)
+        if digest is not None:
+            if rev_id is None:
+                attrs = index.lookup(self._get_owner_key(), digest)
+            elif index.revision(rev_id) == digest:
+                attrs = index.get(rev_id)
+            else:
+                attrs = None
+            metrics.cache('dedup', attrs is not None)
+            if attrs is not None:
+                get_logger().debug('Upload skipped, same data as doc_id=%s',
+                                   attrs['doc_id'])
+                doc = Document(None, self)
+                doc._attributes.update(attrs)
+                return doc
+        if progress is not None or upload_limiter is not None:
+            # The rate limiting counts towards the timeout of the call.
+            end = tasks.current_deadline()
+            limit = _deadline(kwargs.get('timeout', None))
+            if limit is not None and (end is None or limit < end):
+                end = limit
+            file = multipart.ShapedFile(file, upload_limiter, progress, end)
+        xml = self._send_request('docs.upload', file=(file, name), **kwargs)
+        doc = Document(xml, self)
+        if text_index is not None:
+            # Scribd titles new documents after the file name. A new
+            # revision keeps the title of the document.
+            defaults = None
+            if rev_id is None:
+                defaults = {'title': os.path.splitext(name)[0]}
+            text_index.add(doc, defaults)
+        if digest is not None:
+            attrs = doc.get_attributes()
+            if rev_id is not None:
+                attrs['doc_id'] = rev_id
+            index.record(self._get_owner_key(), digest, attrs)
+        return doc
         
     def upload_from_url(self, url, **kwargs):
         """Uploads a file from a remote URL as a new document and returns
@@ -487,6 +797,11 @@ class User(Resource):
     def _get_id(self):
         return getattr(self, 'user_id', 'api_user')
 
+    def _get_owner_key(self):
+        # Returns a string identifying the user among both
+        # the real and virtual users.
+        return '%s:%s' % (self.__class__.__name__, self.id)
+
 
 class VirtualUser(User):
     """Provides an easy way to implement virtual users within the current
@@ -503,12 +818,39 @@ class VirtualUser(User):
     name of the virtual user to the constructor. This will most probably
     be the name used by your own authentication system.
 
+    Objects are interned: as long as an object of a virtual user exists,
+    instantiating the class with the same name returns that object.
+
     Because this is a subclass of the [User] class, the virtual users provide
     the same set of operations (except get_autologin_url()) as normal users.
     
     Resource attributes:
       None.
     """
+
+    __slots__ = ('my_user_id',)
+
+    # Existing objects by my_user_id.
+    _registry = weakref.WeakValueDictionary()
+    _registry_lock = threading.Lock()
+
+    def __new__(cls, my_user_id):
+        forksafe.check()
+        cls._registry_lock.acquire()
+        try:
+            key = (cls, my_user_id)
+            self = cls._registry.get(key)
+            if self is None:
+                self = User.__new__(cls)
+                cls._registry[key] = self
+            return self
+        finally:
+            cls._registry_lock.release()
+
+    def _after_fork(cls):
+        # The lock might have been held by a thread of the parent process.
+        cls._registry_lock = threading.Lock()
+    _after_fork = classmethod(_after_fork)
     
     def __init__(self, my_user_id):
         """Instantiates a new object.
@@ -518,6 +860,9 @@ class VirtualUser(User):
             Name of the virtual user. Every time an object is created
             with the same name, it will refer to the same virtual user.
         """
+        if hasattr(self, '_attributes'):
+            # Interned object, already initialized.
+            return
         self.my_user_id = my_user_id
         User.__init__(self)
         
@@ -616,10 +961,12 @@ class Document(Resource):
         attributes. For more information refer to the load() method
         documentation.
     """
+
+    __slots__ = ('owner',)
     
-    def __init__(self, xml, owner):
-        self.owner = owner
-        Resource.__init__(self, xml)
+    def __init__(self, xml, owner, fields=None):
+        _set_slot(self, 'owner', owner)
+        Resource.__init__(self, xml, _projection(fields))
 
     def _send_request(self, method, **fields):
         """Sends a request to the HOST and returns the XML response."""
@@ -645,6 +992,10 @@ class Document(Resource):
         document.
         """
         self._send_request('docs.delete', doc_id=self.doc_id)
+        if dedup_index is not None:
+            dedup_index.forget(self.doc_id)
+        if text_index is not None:
+            text_index.remove(self)
 
     def get_download_url(self, doc_type='original'):
         """Returns a link that can be used to download a static version of the
@@ -664,6 +1015,38 @@ class Document(Resource):
                                  doc_type=doc_type)
         return str(xml.get('download_link').text)
 
+    def download(self, dest, doc_type='original', parts=4):
+        """Downloads a static version of the document to a file.
+
+        Parameters:
+          dest
+            Destination file path or an existing directory. In the latter
+            case, the file name is taken from the download link.
+          doc_type
+            (optional) Refer to the get_download_url() method.
+          parts
+            (optional) Maximal number of parallel connections used to
+            download a large file. Used only if the download server
+            supports HTTP Range requests.
+
+        Returns:
+            The path of the downloaded file.
+
+        The data is streamed to disk in blocks. If a download is interrupted,
+        calling this method again resumes it from where it stopped. The
+        connections are subject to the CONNECT_TIMEOUT and READ_TIMEOUT
+        socket timeouts.
+        """
+        import urllib, urlparse
+        from scribd import download
+        url = self.get_download_url(doc_type)
+        if os.path.isdir(dest):
+            name = os.path.basename(urlparse.urlparse(url)[2])
+            if not name:
+                name = '%s.%s' % (self.doc_id, doc_type)
+            dest = os.path.join(dest, urllib.unquote(name))
+        return download.download(url, dest, parts, READ_TIMEOUT, CONNECT_TIMEOUT)
+
     def load(self):
         """Retrieves the detailed meta-data for this document and updates
         object's resource attributes.
@@ -691,14 +1074,25 @@ class Document(Resource):
 
         Requires the document owner to be the user that uploaded this
         document.
+
+        Only the attributes whose values differ from the loaded ones are
+        sent. Returns True if an API call was made, False if there was
+        nothing to save.
         """
-        if self._set_attributes:
+        if not self._set_attributes:
+            return False
+        changes = self._get_changes()
+        metrics.count('changes_skipped_total', len(self._set_attributes) - len(changes))
+        if changes:
             self._send_request('docs.changeSettings', doc_ids=self.doc_id,
-                               **self._set_attributes)
-            self._attributes.update(self._set_attributes)
-            self._set_attributes.clear()
-            return True
-        return False
+                               **changes)
+            metrics.count('changes_sent_total', len(changes))
+        else:
+            metrics.count('change_calls_skipped_total')
+        self._store_attributes(self._set_attributes.copy())
+        if changes and text_index is not None:
+            text_index.add(self)
+        return bool(changes)
         
     def replace(self, file, name=None, **kwargs):
         """Uploads a new file in place of the current document. All
@@ -789,27 +1183,131 @@ class Document(Resource):
         self._send_request('security.setAccess', user_identifier=user, allowed=allowed,
                            doc_id=self.doc_id)
 
+    def secure_embed_params(self, user, session_id):
+        """Computes the parameters of an iPaper Secure embed code of this
+        document viewed by a virtual user.
+
+        The signature is computed locally using the API secret, no API
+        call is made.
+
+        Parameters:
+          user
+            Virtual user's name or [VirtualUser] object.
+          session_id
+            Identifier of the viewer's session in your system.
+
+        Returns:
+            A dictionary with "document_id", "session_id", "user_identifier"
+            and "signature" keys and the "access_key" key if the document's
+            access_key resource attribute is known. Pass these to the
+            embed code.
+
+        This method is part of iPaper Secure. For more info about iPaper Secure visit:
+        http://www.scribd.com/publisher/ipaper_secure
+        """
+        if isinstance(user, VirtualUser):
+            user = user.my_user_id
+        params = {'document_id': self.doc_id,
+                  'session_id': session_id,
+                  'user_identifier': user}
+        params['signature'] = sign(params)
+        access_key = getattr(self, 'access_key', None)
+        if access_key is not None:
+            params['access_key'] = access_key
+        return params
+
     def _get_id(self):
         return self.doc_id
 
 
+class PageSizer(object):
+    """Chooses the page size of the listings (the "page_size" parameter
+    of xall() and xfind()) adapting it to the observed response times
+    and sizes.
+
+    After every page, the size of the next one is scaled toward the one
+    that would take "target_latency" seconds (and, if "max_bytes" is set,
+    would be smaller than "max_bytes" bytes). The size changes by no more
+    than a factor of two at once and stays between "minimum" and
+    "maximum".
+
+    The object may be reused by many listings to keep the tuned size.
+    The "pages" attribute is a list of (page_size, documents, seconds,
+    bytes) tuples describing the pages fetched so far (the last 100).
+    """
+
+    def __init__(self, initial=100, minimum=10, maximum=1000,
+                 target_latency=1.0, max_bytes=None):
+        """Instantiates a new sizer.
+
+        Parameters:
+          initial
+            (optional) Size of the first page.
+          minimum, maximum
+            (optional) Bounds of the page size.
+          target_latency
+            (optional) Desired time of a single page request in seconds.
+          max_bytes
+            (optional) Maximal desired size of a single response in bytes.
+        """
+        if not 0 < minimum <= maximum:
+            raise ValueError('expected 0 < minimum <= maximum')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.page_size = max(minimum, min(maximum, initial))
+        self.pages = []
+
+    def observe(self, page_size, count, seconds, nbytes):
+        """Records a fetched page of "count" documents requested with
+        "page_size" and adjusts the size of the next page.
+        """
+        self.pages.append((page_size, count, seconds, nbytes))
+        del self.pages[:-100]
+        if count < page_size:
+            # The last page, says nothing about larger ones.
+            return
+        scale = 2.0
+        if seconds > 0:
+            scale = min(scale, self.target_latency / seconds)
+        if self.max_bytes and nbytes:
+            scale = min(scale, float(self.max_bytes) / nbytes)
+        scale = max(0.5, scale)
+        size = int(page_size * scale)
+        self.page_size = max(self.minimum, min(self.maximum, size))
+        if self.minimum != self.maximum:
+            get_logger().debug('Page of %d documents took %.3f s (%d bytes), '
+                               'next page size %d', count, seconds, nbytes,
+                               self.page_size)
+
+
 #
 # Functions
 #
 
-def send_request(method, **fields):
+def send_request(method, priority=None, timeout=None, **fields):
     """Sends an API request to the HOST and returns the XML response.
     
     Parameters:
       method
         Name of the method to perform.
+      priority
+        (optional) INTERACTIVE or BACKGROUND. Used by the scheduler
+        if set. Defaults to the priority of the current thread, see
+        the priority() function.
+      timeout
+        (optional) Maximal number of seconds the call may take including
+        the retries. Limited further by the deadline() of the current
+        thread.
       keyword arguments
         Sent as method arguments. If a keyword argument's value is None,
         the argument is ignored (not sent).
     
     Returns:
         An xmlparse.Element object representing the root of the HOST's
-        XML response.
+        XML response. Its "size" attribute is the size of the response
+        in bytes.
     
     Raises:
       MalformedResponseError
@@ -817,55 +1315,155 @@ def send_request(method, **fields):
       ResponseError
         If the response indicates an error. The exception object contains
         the error code and message reported by the HOST.
-    """
-    if not api_key or not api_secret:
-        raise NotReadyError('configure API key and secret first')
-    if not method:
-        raise ValueError('method must be specified')
+      TimeoutError
+        If the call didn't finish in time.
 
-    fields['method'] = method
-    fields['api_key'] = api_key
+    If the method is one of COALESCED_METHODS and an identical call of
+    the same priority is already in progress in another thread, waits
+    for that call and returns its response instead of sending a new
+    request.
 
-    for k, v in fields.items():
-        if v is None:
-            del fields[k]
+    If scribd.metrics are enabled, the call is recorded there. If a
+    scribd.profiler.Profile is running, the call's phases are timed.
+    """
+    if priority is not None:
+        previous = tasks.set_priority(priority)
+        try:
+            return send_request(method, timeout=timeout, **fields)
+        finally:
+            tasks.set_priority(previous)
+    if timeout is not None:
+        end = time() + timeout
+        previous = tasks.current_deadline()
+        if previous is None or end < previous:
+            tasks.set_deadline(end)
+            try:
+                return send_request(method, **fields)
+            finally:
+                tasks.set_deadline(previous)
+    if method in COALESCED_METHODS:
+        try:
+            # Calls of different priorities aren't shared, a BACKGROUND
+            # call queued by the scheduler mustn't hold up INTERACTIVE ones.
+            key = (api_key, method, tasks.current_priority()) + \
+                  tuple(sorted(fields.items()))
+            hash(key)
+        except TypeError:
+            pass # Unhashable argument, perform the call normally.
         else:
-            if isinstance(v, unicode):
-                v = v.encode('utf8')
-            elif isinstance(v, tuple): # file
-                v = (v[0], str(v[1])) # (data, name)
-            elif isinstance(v, bool):
-                v = str(int(v)) # '0' or '1'
+            return _coalesced_request(key, method, fields)
+    return _measured_request(method, fields)
+
+
+def _coalesced_request(key, method, fields):
+    # Performs the call or waits for an identical one in progress.
+    global _flights
+    if _flights is None:
+        # Two threads may get here at once and create two objects. Only
+        # the calls made at that moment aren't coalesced then.
+        _flights = tasks.SingleFlight()
+    performed = []
+    def perform():
+        performed.append(True)
+        return _measured_request(method, fields)
+    while True:
+        shared = True
+        try:
+            try:
+                return _flights.do(key, perform)
+            except tasks.DeadlineExceeded:
+                raise TimeoutError('deadline exceeded: %s' % method)
+            except TimeoutError:
+                if performed:
+                    raise
+                # The deadline of the thread that performed the call has
+                # passed, not ours. Try again, performing the call if no
+                # other thread is doing it already.
+                shared = False
+        finally:
+            if shared and not performed:
+                metrics.count('coalesced_calls_total')
+
+
+def _measured_request(method, fields):
+    # Performs the call, recording its metrics and profile if enabled.
+    if not metrics.enabled and not profiler.active:
+        return _send_request(method, fields, None, None)
+    stats = metrics.CallStats(method)
+    call = profiler.begin(method)
+    try:
+        try:
+            return _send_request(method, fields, stats, call)
+        except ResponseError, err:
+            stats.error = err.errno
+            raise
+        except Exception, err:
+            stats.error = err.__class__.__name__
+            raise
+    finally:
+        if metrics.enabled:
+            metrics.record(stats)
+        if call is not None:
+            profiler.finish(call)
+
+
+def _send_request(method, fields, stats, call):
+    # Performs the send_request() call. If "stats" is a metrics.CallStats
+    # object, it is filled with the statistics of the call. If "call" is
+    # a profiler.CallProfile object, the phases of the call are marked.
+    fields = encode_fields(method, fields)
+    if call is not None:
+        call.mark('encode')
+
+    log = get_logger()
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        deb_fields = fields.copy()
+        del deb_fields['method'], deb_fields['api_key'], deb_fields['api_sig']
+        t = deb_fields.get('file', None)
+        if t is not None:
+            if isinstance(t[0], str):
+                deb_fields['file'] = (t[0][:16] + '(...)', t[1])
             else:
-                v = str(v)
-            fields[k] = v
-
-    deb_fields = fields.copy()
-    del deb_fields['method'], deb_fields['api_key']
-    t = deb_fields.get('file', None)
-    if t is not None:
-        deb_fields['file'] = (t[0][:16] + '(...)', t[1])
-    logger.debug('Request: %s(%s)', method,
-                 ', '.join('%s=%s' % (k, repr(v)) for k, v in deb_fields.items()))
-
-    sign_fields = fields.copy()
-    sign_fields.pop('file', None)
-    sign_items = sign_fields.items()
-    sign_items.sort()
-    sign = md5(api_secret + ''.join(k + v for k, v in sign_items))
-    fields['api_sig'] = sign.hexdigest()
+                deb_fields['file'] = (t[0].__class__.__name__ + '(...)', t[1])
+        log.debug('Request: %s(%s)', method,
+                  ', '.join('%s=%s' % (k, repr(v)) for k, v in deb_fields.items()))
 
     headers = {'Cache-Control': 'no-store'}
 
+    end = tasks.current_deadline()
     start_time = time()
+    attempt = 0
     while True:
+        if stats is not None:
+            stats.retries = attempt
+        attempt += 1
+        if call_limiter is not None and not call_limiter.acquire(deadline=end):
+            raise TimeoutError('deadline exceeded: %s' % method)
+        sched = scheduler
+        if sched is not None and not sched.acquire(deadline=end):
+            raise TimeoutError('deadline exceeded: %s' % method)
         try:
-            resp = post_multipart(HOST, REQUEST_PATH, fields.items(), headers, PORT)
+            try:
+                connect_timeout, read_timeout = _timeouts(method, end)
+                resp = _post(method, fields, headers, connect_timeout, read_timeout, end)
+            finally:
+                if sched is not None:
+                    sched.release()
+        except TimeoutError:
+            raise
+        except tasks.DeadlineExceeded:
+            raise TimeoutError('deadline exceeded: %s' % method)
         except Exception, err:
+            if end is not None and time() >= end:
+                raise TimeoutError('deadline exceeded: %s (%s)' % (method, err))
             if time() - start_time < 10:
                 continue
             raise NotReadyError(str(err))
-        
+
+        if stats is not None:
+            stats.request_bytes += getattr(resp, 'request_bytes', 0)
+            stats.response_bytes += len(getattr(resp, 'body', ''))
         status = resp.getheader('Status', '200').split()[0]
         if status == '200':
             # Content-Type must be application/xml.
@@ -878,11 +1476,18 @@ def send_request(method, **fields):
                 except:
                     raise MalformedResponseError(
                             'remote host response could not be interpreted')
+                xml.size = len(getattr(resp, 'body', ''))
+                if call is not None:
+                    call.mark('parse')
+                    xml.profile = call
             else:
                 raise MalformedResponseError(
                         'unexpected remote host response format: %s' % ctype)
         elif status == '500': # Internal Server Error
             # Retrying usually helps if this happens so lets do so for max. 10 seconds.
+            if end is not None and time() >= end:
+                raise TimeoutError('deadline exceeded: %s (remote host internal error)' %
+                                   method)
             if time() - start_time < 10:
                 continue
             raise NotReadyError('remote host internal error')
@@ -890,7 +1495,8 @@ def send_request(method, **fields):
             raise NotReadyError('remote host status error: %s' % status)
         break
 
-    logger.debug('Response: %s', xml.toxml())
+    if debug:
+        log.debug('Response: %s', xml.toxml())
 
     if xml.attrs['stat'] == 'fail':
         try:
@@ -908,6 +1514,223 @@ def send_request(method, **fields):
     return xml
 
 
+def encode_fields(method, fields):
+    """Converts the arguments of an API call to the fields sent to
+    the HOST.
+
+    Parameters:
+      method
+        Name of the method to perform.
+      fields
+        A mapping of the method arguments. Refer to send_request().
+
+    Returns:
+        A new dictionary mapping the field names to strings (or (data, name)
+        tuples for files) including the "method", "api_key" and "api_sig"
+        fields.
+    """
+    if not api_key or not api_secret:
+        raise NotReadyError('configure API key and secret first')
+    if not method:
+        raise ValueError('method must be specified')
+
+    encoded = {'method': method, 'api_key': api_key}
+    for k, v in fields.items():
+        if v is not None:
+            if isinstance(v, tuple): # file
+                v = (v[0], str(v[1])) # (data, name)
+            else:
+                v = _encode_value(v)
+            encoded[k] = v
+
+    sign_fields = encoded.copy()
+    sign_fields.pop('file', None)
+    encoded['api_sig'] = sign(sign_fields)
+    return encoded
+
+
+def _post(method, fields, headers, connect_timeout, read_timeout, end):
+    # Posts the request, hedging it if enabled for the method. The request
+    # has to finish by "end" (or None).
+    h = hedger
+    if h is None or method not in HEDGED_METHODS:
+        return post_multipart(HOST, REQUEST_PATH, fields.items(), headers, PORT,
+                              connection_pool, connect_timeout, read_timeout)
+    def post(attempt):
+        return post_multipart(HOST, REQUEST_PATH, fields.items(), headers, PORT,
+                              _AttemptPool(connection_pool, attempt), connect_timeout,
+                              read_timeout)
+    level = tasks.current_priority()
+    def admit():
+        # The extra request counts against the call limit and takes its
+        # own scheduler slot like any other request.
+        if call_limiter is not None and not call_limiter.acquire(deadline=end):
+            return None
+        sched = scheduler
+        if sched is None:
+            return _release_nothing
+        if not sched.acquire(level, end):
+            return None
+        return sched.release
+    return h.call(method, post, admit)
+
+
+def _release_nothing():
+    pass
+
+
+class _AttemptPool(object):
+    # Wraps the connection pool so the connection used by a hedged
+    # request can be shut down if the other request wins. Once the
+    # connection is returned to the pool, it's no longer touched.
+
+    def __init__(self, pool, attempt):
+        self.pool = pool
+        self.attempt = attempt
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def get(self, host, port=None):
+        conn = self.conn = self.pool.get(host, port)
+        self.attempt.on_cancel(self._abort)
+        if self.attempt.cancelled:
+            # A new connection isn't open yet, _abort() can't stop it.
+            self.put(conn, host, port)
+            raise tasks.Cancelled('request cancelled')
+        return conn
+
+    def put(self, conn, host, port=None):
+        self._lock.acquire()
+        try:
+            self.conn = None
+        finally:
+            self._lock.release()
+        self.pool.put(conn, host, port)
+
+    def _abort(self):
+        # Makes the pending socket operations of the connection fail.
+        import socket
+        self._lock.acquire()
+        try:
+            if self.conn is not None and self.conn.sock is not None:
+                try:
+                    self.conn.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        finally:
+            self._lock.release()
+
+
+def _timeouts(method, end):
+    # Returns the (connect, read) socket timeouts of a request that has
+    # to finish by "end" (or None). Raises TimeoutError if it's too late.
+    connect_timeout, read_timeout = CONNECT_TIMEOUT, READ_TIMEOUT
+    if end is not None:
+        remaining = end - time()
+        if remaining <= 0:
+            raise TimeoutError('deadline exceeded: %s' % method)
+        if connect_timeout is None or remaining < connect_timeout:
+            connect_timeout = remaining
+        if read_timeout is None or remaining < read_timeout:
+            read_timeout = remaining
+    return connect_timeout, read_timeout
+
+
+def _deadline(timeout):
+    # Returns the time by which a call limited to "timeout" seconds
+    # has to finish or None.
+    if timeout is None:
+        return None
+    return time() + timeout
+
+
+def _page_sizer(page_size):
+    # Returns a PageSizer object for the "page_size" parameter of the
+    # listings. Fixed sizes get a sizer that never changes.
+    if isinstance(page_size, PageSizer):
+        return page_size
+    if page_size == 'auto':
+        return PageSizer()
+    return PageSizer(page_size, page_size, page_size)
+
+
+def _projection(fields):
+    # Returns the names of the document attributes to keep as a frozenset
+    # always including "doc_id", or None if all attributes are kept.
+    if fields is None or (isinstance(fields, frozenset) and 'doc_id' in fields):
+        return fields
+    return frozenset(fields).union(['doc_id'])
+
+
+def _encode_value(value):
+    # Converts an argument value to the string sent to the HOST.
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    if isinstance(value, bool):
+        return str(int(value)) # '0' or '1'
+    return str(value)
+
+
+def sign(fields):
+    """Computes a signature of the fields using the API secret.
+
+    This is the scheme used to sign the API calls and the iPaper Secure
+    embed codes: an md5 hex digest of the secret followed by the field
+    names and values sorted by name.
+
+    Parameters:
+      fields
+        A mapping of field names to values. Values are converted to
+        strings.
+
+    Returns:
+        The signature (string).
+    """
+    global _sign_prefix
+    if not api_secret:
+        raise NotReadyError('configure API key and secret first')
+    items = fields.items()
+    items.sort()
+    # The md5 object fed with the secret is computed once and copied.
+    secret, prefix = _sign_prefix
+    if secret != api_secret:
+        # Both md5 module (deprecated since Python 2.5) and hashlib provide
+        # the same md5 object.
+        if sys.version_info >= (2, 5):
+            from hashlib import md5
+        else:
+            from md5 import md5
+        secret, prefix = api_secret, md5(api_secret)
+        _sign_prefix = (secret, prefix)
+    h = prefix.copy()
+    for k, v in items:
+        if isinstance(v, unicode):
+            v = v.encode('utf8')
+        h.update(k + str(v))
+    return h.hexdigest()
+
+_sign_prefix = (None, None)
+
+
+def secure_embed_params_many(docs, user, session_id):
+    """Computes the iPaper Secure embed parameters of many documents
+    viewed by one virtual user.
+
+    Parameters:
+      docs
+        A sequence of [Document] objects.
+      user, session_id
+        Refer to the [Document].secure_embed_params() method.
+
+    Returns:
+        A list of dictionaries as returned by the
+        [Document].secure_embed_params() method.
+    """
+    return [doc.secure_embed_params(user, session_id) for doc in docs]
+
+
 def login(username, password):
     """Logs the given Scribd user in and returns the corresponding [User] object.
     
@@ -965,8 +1788,15 @@ def update(docs, **fields):
         
     All documents must have the same owner. The operation is faster because
     it requires only one API call.
+
+    Documents already having the given values are left out of the call
+    and so are the attributes that none of the remaining documents needs
+    to change. If nothing changes at all, no API call is made.
     """
     owner = None
+    changed = []
+    names = set()
+    count = 0
     for doc in docs:
         if not isinstance(doc, Document):
             raise ValueError('expected a sequence of Document objects')
@@ -974,15 +1804,444 @@ def update(docs, **fields):
             owner = doc.owner
         elif owner != doc.owner:
             raise ValueError('all documents must have the same owner')
+        count += 1
+        changes = doc._get_changes(fields)
+        if changes:
+            changed.append(doc)
+            names.update(changes)
     if owner is not None:
-        owner._send_request('docs.changeSettings',
-                            doc_ids=','.join(doc.id for doc in docs),
-                            **fields)
-    # We have to set the attributes one by one to let the document's
-    # __setattr__() decide what to do with it.
+        sent = len(changed) * len(names)
+        metrics.count('changes_skipped_total', count * len(fields) - sent)
+        if changed:
+            owner._send_request('docs.changeSettings',
+                                doc_ids=','.join(str(doc.id) for doc in changed),
+                                **dict((name, fields[name]) for name in names))
+            metrics.count('changes_sent_total', sent)
+        else:
+            metrics.count('change_calls_skipped_total')
     for doc in docs:
-        for name, value in fields.items():
-            setattr(doc, name, value)
+        doc._store_attributes(fields)
+    if changed and text_index is not None:
+        for doc in changed:
+            text_index.add(doc)
+
+
+def upload_many(user, files, concurrency=4, max_bytes=64 * 1024 * 1024,
+                settings=None, callback=None, ordered=False, **kwargs):
+    """Uploads many files concurrently.
+
+    Parameters:
+      user
+        The [User] object to upload the files as.
+      files
+        An iterable of file paths, file-alike objects or (file, name)
+        tuples. Consumed lazily so it may be a generator producing
+        a very long list of files. Paths are opened only right before
+        the upload.
+      concurrency
+        (optional) Number of uploads performed at once.
+      max_bytes
+        (optional) Maximal total size of the files being uploaded at once.
+        A single file larger than this is uploaded alone.
+      settings
+        (optional) A dictionary of document resource attributes (title,
+        tags, description, ...) saved right after every upload or a
+        callable taking the item of "files" and returning such
+        dictionary (or None).
+      callback
+        (optional) A callable taking (file, document, error) arguments
+        called for every finished upload. Refer to the returned value
+        below for the description of the arguments.
+      ordered
+        (optional) If True, the results are produced in the order of
+        "files". Otherwise they are produced as soon as they are ready.
+      keyword arguments
+        Passed to the [User].upload() method, for example "access".
+
+    Returns:
+        If "callback" is None, a generator object yielding (file, document,
+        error) tuples where "file" is the item of "files", "document" is
+        the uploaded [Document] object and "error" is None or the exception
+        raised by the upload in which case "document" is None.
+        
+        If "callback" is given, the function returns None after all files
+        are uploaded.
+
+    Connections to the HOST are reused by the uploads and files are
+    streamed from disk so the memory usage doesn't depend on the file sizes.
+    """
+    budget = tasks.Budget(max_bytes)
+
+    def sized():
+        # Yields (item, size, error) tuples, acquiring the budget on the
+        # way. A file whose size can't be read fails on its own.
+        for item in files:
+            try:
+                size = _upload_size(item)
+            except EnvironmentError, err:
+                yield item, 0, err
+                continue
+            budget.acquire(size)
+            yield item, size, None
+
+    def upload(entry):
+        item, size, error = entry
+        if error is not None:
+            raise error
+        try:
+            return _upload_one(user, item, settings, kwargs)
+        finally:
+            budget.release(size)
+
+    results = _upload_results(tasks.imap(upload, sized(), concurrency, ordered), budget)
+    if callback is None:
+        return results
+    for file, doc, error in results:
+        callback(file, doc, error)
+
+
+def _upload_results(results, budget):
+    try:
+        for (item, size, size_error), doc, error in results:
+            yield item, doc, error
+    finally:
+        # If the consumer stops early, the items already queued are
+        # skipped without releasing their budget. Stop the pool first,
+        # then wake the feeder waiting for the budget so it can see it.
+        results.close()
+        budget.close()
+
+
+def _upload_size(item):
+    # Returns the number of bytes that will be uploaded for an item
+    # passed to upload_many().
+    if isinstance(item, tuple):
+        item = item[0]
+    if isinstance(item, basestring):
+        return os.path.getsize(item)
+    try:
+        pos = item.tell()
+        item.seek(0, 2)
+        size = item.tell() - pos
+        item.seek(pos)
+    except (AttributeError, IOError, ValueError):
+        size = 0
+    return size
+
+
+def _upload_one(user, item, settings, kwargs):
+    # Uploads an item passed to upload_many() and saves the settings.
+    file, name = item, None
+    if isinstance(file, tuple):
+        file, name = file
+    if isinstance(file, basestring):
+        name = name or file
+        file = open(file, 'rb')
+        try:
+            doc = user.upload(file, name, **kwargs)
+        finally:
+            file.close()
+    else:
+        doc = user.upload(file, name, **kwargs)
+    if callable(settings):
+        settings = settings(item)
+    if settings:
+        for key, value in settings.items():
+            setattr(doc, key, value)
+        doc.save()
+    return doc
+
+
+def download_many(docs, dest, doc_type='original', concurrency=4, parts=1):
+    """Downloads static versions of many documents concurrently.
+
+    Parameters:
+      docs
+        An iterable of [Document] objects.
+      dest
+        An existing directory to store the files in.
+      doc_type
+        (optional) Refer to the [Document].get_download_url() method.
+      concurrency
+        (optional) Number of documents downloaded at once. Both the
+        download links and the files are acquired concurrently.
+      parts
+        (optional) Refer to the [Document].download() method.
+
+    Returns:
+        A generator object yielding (document, path, error) tuples as soon
+        as the downloads finish. If the download failed, "path" is None
+        and "error" is the exception raised.
+    """
+    if not os.path.isdir(dest):
+        raise ValueError('dest must be an existing directory')
+    def download(doc):
+        return doc.download(dest, doc_type, parts)
+    return tasks.imap(download, docs, concurrency)
+
+
+def fetch_thumbnails(docs, cache_dir, concurrency=4, **kwargs):
+    """Downloads the thumbnails of many documents concurrently into an
+    on-disk cache.
+
+    Parameters:
+      docs
+        An iterable of [Document] objects.
+      cache_dir
+        Path of the cache directory (created if needed) or
+        a thumbnails.ThumbnailCache object.
+      concurrency
+        (optional) Number of thumbnails downloaded at once.
+      keyword arguments
+        Passed to the thumbnails.ThumbnailCache constructor, for example
+        "max_bytes" and "max_age".
+
+    Returns:
+        A generator object yielding (document, path, error) tuples as soon
+        as the thumbnails are available. "path" is the local path of the
+        thumbnail or None if the document has no thumbnail or the download
+        failed in which case "error" is the exception raised.
+
+    Thumbnails already in the cache are returned without downloading them
+    again. Refer to the scribd.thumbnails module for details.
+
+    Documents without the "thumbnail_url" attribute (for example listed
+    with a "fields" projection) are loaded first, see [Document].load().
+    """
+    from scribd.thumbnails import ThumbnailCache
+    cache = cache_dir
+    if not isinstance(cache, ThumbnailCache):
+        cache = ThumbnailCache(cache_dir, **kwargs)
+    # Documents sharing a thumbnail URL wait for a single download.
+    urls = {}
+    missing = []
+    unknown = []
+    for doc in docs:
+        url = getattr(doc, 'thumbnail_url', None)
+        if url:
+            urls.setdefault(url, []).append(doc)
+        elif url is None:
+            unknown.append(doc)
+        else:
+            missing.append(doc)
+
+    def fetch(item):
+        # The items are the known URLs and the documents to load.
+        if isinstance(item, Document):
+            item.load()
+            url = getattr(item, 'thumbnail_url', None)
+            if not url:
+                return None
+            item = url
+        return cache.get(item)
+
+    results = tasks.imap(fetch, urls.keys() + unknown, concurrency)
+    return _thumbnail_results(results, urls, missing)
+
+
+def _thumbnail_results(results, urls, missing):
+    for doc in missing:
+        yield doc, None, None
+    for item, path, error in results:
+        if isinstance(item, Document):
+            yield item, path, error
+            continue
+        for doc in urls[item]:
+            yield doc, path, error
+
+
+def set_access_many(users, docs, allowed, concurrency=4):
+    """Disables or re-enables access of many virtual users to many secure
+    documents.
+
+    Parameters:
+      users
+        A sequence of virtual users' names or [VirtualUser] objects.
+      docs
+        A sequence of [Document] objects.
+      allowed
+        Refer to the [Document].set_access() method.
+      concurrency
+        (optional) Number of API calls performed at once.
+
+    Returns:
+        A generator object yielding (user, document, error) tuples for every
+        combination of the users and documents as soon as the call is done.
+        "error" is None or the exception raised by the call.
+
+    This function is part of iPaper Secure. For more info about iPaper Secure visit:
+    http://www.scribd.com/publisher/ipaper_secure
+    """
+    docs = list(docs)
+    pairs = [(user, doc) for user in users for doc in docs]
+    def set_access(pair):
+        user, doc = pair
+        doc.set_access(user, allowed)
+    return _pair_results(tasks.imap(set_access, pairs, concurrency))
+
+
+def _pair_results(results):
+    for (user, doc), result, error in results:
+        yield user, doc, error
+
+
+def revoke_all(users, concurrency=4):
+    """Disables access of virtual users to all secure documents.
+
+    Parameters:
+      users
+        A virtual user's name or [VirtualUser] object or a sequence of them.
+      concurrency
+        (optional) Number of API calls performed at once.
+
+    Returns:
+        A generator object yielding (user, error) tuples as soon as access
+        of the user is disabled. "error" is None or the exception raised
+        by the call.
+
+    A single API call is made per user. Use [VirtualUser].set_access()
+    or set_access_many() to re-enable access.
+
+    This function is part of iPaper Secure. For more info about iPaper Secure visit:
+    http://www.scribd.com/publisher/ipaper_secure
+    """
+    if isinstance(users, (basestring, VirtualUser)):
+        users = [users]
+    def revoke(user):
+        if not isinstance(user, VirtualUser):
+            user = VirtualUser(user)
+        user.set_access(False)
+    for user, result, error in tasks.imap(revoke, users, concurrency):
+        yield user, error
+
+
+def wait_for_conversion(docs, timeout=None, interval=1.0, max_interval=30.0,
+                        backoff=1.5, jitter=0.1, batch_threshold=2):
+    """Waits for the conversion of many documents at once and returns
+    a generator object yielding the documents as soon as their conversion
+    finishes.
+
+    Parameters:
+      docs
+        A sequence of [Document] objects.
+      timeout
+        (optional) Maximal number of seconds to wait. If None, waits
+        until all documents are finished.
+      interval
+        (optional) Number of seconds between the first status checks.
+      max_interval
+        (optional) Upper limit for the number of seconds between the
+        status checks. After every check that didn't finish all
+        documents, the interval is multiplied by "backoff" until it
+        reaches this limit.
+      backoff
+        (optional) Factor the interval grows by after every check.
+      jitter
+        (optional) Fraction of the interval by which every sleep is
+        randomly lengthened or shortened, so that many waiting processes
+        don't poll the HOST in lockstep.
+      batch_threshold
+        (optional) Minimal number of pending documents of one owner for
+        which their statuses are read from the owner's document list
+        (docs.getList) instead of asking for every document separately.
+        The list is read only while it takes fewer calls than there are
+        pending documents, judging by the list size seen before.
+
+    Returns:
+        A generator object yielding [Document] objects whose conversion
+        status is one of CONVERSION_FINISHED ('DONE' or 'ERROR'). The
+        status is available as the conversion_status resource attribute
+        of the yielded documents.
+
+    Documents that are not yielded before the generator stops are still
+    being converted (the timeout has passed).
+
+    Example:
+        Instead of:
+
+            for doc in docs:
+                while doc.get_conversion_status() != 'DONE':
+                    time.sleep(2)
+        use:
+
+            for doc in wait_for_conversion(docs):
+                if doc.conversion_status == 'ERROR':
+                    ...
+    """
+    import random
+    pending = {}
+    for doc in docs:
+        if not isinstance(doc, Document):
+            raise ValueError('expected a sequence of Document objects')
+        pending[doc.id] = doc
+    start_time = time()
+    end = _deadline(timeout)
+    # Owner -> lower bound of the number of documents in the owner's list.
+    list_sizes = {}
+    while pending:
+        # Group the pending documents by owner. Documents of one owner
+        # can be checked with a few docs.getList calls.
+        owners = {}
+        for doc in pending.values():
+            owners.setdefault(doc.owner, []).append(doc)
+        finished = []
+        for owner, owned in owners.items():
+            unknown = owned
+            # Reading the list pays off if it takes fewer pages than
+            # there are documents to ask for one by one.
+            max_pages = len(owned) - 1
+            size = list_sizes.get(owner)
+            if len(owned) >= batch_threshold and \
+                    (size is None or size < max_pages * STATUS_PAGE_SIZE):
+                unknown, list_sizes[owner] = _read_conversion_statuses(owner, owned,
+                                                                       max_pages, end)
+            # Ask for documents not found in the list one by one.
+            for doc in unknown:
+                if end is not None and time() >= end:
+                    break
+                doc._attributes['conversion_status'] = doc.get_conversion_status()
+            for doc in owned:
+                if doc._attributes.get('conversion_status') in CONVERSION_FINISHED:
+                    finished.append(doc)
+        for doc in finished:
+            del pending[doc.id]
+            yield doc
+        if not pending:
+            break
+        delay = interval * random.uniform(1.0 - jitter, 1.0 + jitter)
+        if timeout is not None:
+            remaining = timeout - (time() - start_time)
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+        sleep(delay)
+        interval = min(interval * backoff, max_interval)
+
+
+def _read_conversion_statuses(owner, docs, max_pages, end):
+    # Updates the conversion_status resource attribute of the given
+    # documents using the owner's document list. Stops reading the list
+    # as soon as all documents are found, after "max_pages" pages or if
+    # the "end" time has passed. Returns a (missing, size) tuple where
+    # "missing" is a list of the documents that weren't found and "size"
+    # is a lower bound of the number of documents in the list.
+    missing = dict((str(doc.id), doc) for doc in docs)
+    seen = 0
+    for result in owner.xall(page_size=STATUS_PAGE_SIZE,
+                             fields=('doc_id', 'conversion_status')):
+        seen += 1
+        doc = missing.pop(str(result.id), None)
+        if doc is not None:
+            doc._attributes['conversion_status'] = result.conversion_status
+            if not missing:
+                break
+        if seen % STATUS_PAGE_SIZE == 0:
+            # The page is finished, check before the next one is requested.
+            if seen // STATUS_PAGE_SIZE >= max_pages:
+                break
+            if end is not None and time() >= end:
+                break
+    return missing.values(), seen
 
 
 def find(query, **kwargs):
@@ -1024,6 +2283,17 @@ def xfind(query, **kwargs):
     return api_user.xfind(query, **kwargs)
 
 
+def get_logger():
+    """Returns the scribd logger. The NullHandler is added to it on first
+    use rather than at import time.
+    """
+    global _logger_ready
+    if not _logger_ready:
+        logger.addHandler(NullHandler())
+        _logger_ready = True
+    return logger
+
+
 def config(key, secret):
     """Configures the API key and secret. These values have to be
     configured before any operation involving API calls can be performed.
@@ -1047,6 +2317,24 @@ def config(key, secret):
 # Objects
 #
 
+# Calls in progress shared by the coalesced requests. A tasks.SingleFlight
+# object created on first use.
+_flights = None
+
+# Pool of the connections to the HOST reused by the API calls.
+connection_pool = ConnectionPool()
+
+# Descriptors of the commonly used resource attributes. Reading them
+# doesn't go through Resource.__getattr__().
+_define_attributes(User, ('user_id', 'username', 'name', 'session_key'))
+_define_attributes(Document, ('doc_id', 'title', 'description', 'tags', 'license',
+                              'access', 'show_ads', 'access_key', 'secret_password',
+                              'conversion_status', 'page_count', 'thumbnail_url',
+                              'reads'))
+
+# Rebuild the VirtualUser registry lock in forked processes.
+forksafe.register(VirtualUser)
+
 # The API account user. Represents the user that registered the current
 # API account. Note that the object doesn't support standard user
 # object attributes like "name" or "username". These are supported only
@@ -1056,5 +2344,6 @@ api_user = User()
 
 # Create a scribd logger using the logging library. If logging is enabled
 # by the application, scribd library will log all performed API calls.
+# The handler is added by get_logger().
 logger = logging.getLogger('scribd')
-logger.addHandler(NullHandler())
+_logger_ready = False
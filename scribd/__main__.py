@@ -0,0 +1,13 @@
+"""
+Runs the command-line tool, see the scribd.cli module.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import sys
+
+from scribd.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Command-line tool for bulk operations on the documents of an account.
+
+Usage:
+
+    python -m scribd [options] export [--format jsonl|csv] [--output FILE]
+    python -m scribd [options] upload DIRECTORY
+    python -m scribd [options] update NAME=VALUE [NAME=VALUE ...] < ids
+    python -m scribd [options] delete < ids
+    python -m scribd [options] wait < ids
+
+The "update", "delete" and "wait" commands read the doc_ids from the
+standard input, one per line (only the first column of tab separated
+lines is used, so the output of "upload" can be piped in).
+
+The API key and secret are taken from the --api-key and --api-secret
+options or the SCRIBD_API_KEY and SCRIBD_API_SECRET environment
+variables. The documents belong to the API account user unless
+--username is given (the password is taken from the SCRIBD_PASSWORD
+environment variable).
+
+With --resume FILE, the processed doc_ids (or uploaded paths) are
+appended to FILE and skipped if the command is run again, so an
+interrupted run can be continued. The throughput is reported on the
+standard error output.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import os
+import sys
+import threading
+from time import time
+from optparse import OptionParser
+
+import scribd
+from scribd import tasks
+
+
+# Attributes exported to CSV files if --fields isn't given.
+CSV_FIELDS = ('doc_id', 'title', 'description', 'access_key', 'conversion_status',
+              'page_count', 'thumbnail_url')
+
+USAGE = '''%prog [options] COMMAND [ARGS]
+
+commands:
+  export                       write all documents to a JSONL or CSV file
+  upload DIRECTORY             upload the files of a directory
+  update NAME=VALUE [...]      change settings of the documents read from stdin
+  delete                       delete the documents read from stdin
+  wait                         wait for the conversion of the documents read
+                               from stdin'''
+
+
+class Progress(object):
+    """Reports the number of processed items and the throughput on
+    the standard error output.
+    """
+
+    def __init__(self, label, stream=None, interval=1.0):
+        self.label = label
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self._start = time()
+        self._shown = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, ok=True, count=1):
+        self._lock.acquire()
+        try:
+            if ok:
+                self.done += count
+            else:
+                self.failed += count
+            now = time()
+            if now - self._shown >= self.interval:
+                self._shown = now
+                self._show('\r')
+        finally:
+            self._lock.release()
+
+    def finish(self):
+        self._show('\r')
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def _show(self, prefix):
+        elapsed = max(time() - self._start, 1e-6)
+        self.stream.write('%s%s: %d done, %d failed, %.1f/s, %.0f s' %
+                          (prefix, self.label, self.done, self.failed,
+                           self.done / elapsed, elapsed))
+        self.stream.flush()
+
+
+class Journal(object):
+    """Keeps the keys of the processed items in a file so they can be
+    skipped by a resumed run. Without a path, nothing is kept.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.keys = set()
+        self._file = None
+        self._lock = threading.Lock()
+        if path is not None:
+            if os.path.exists(path):
+                for line in open(path):
+                    line = line.strip()
+                    if line:
+                        self.keys.add(line)
+            self._file = open(path, 'a')
+
+    def __contains__(self, key):
+        return str(key) in self.keys
+
+    def add(self, key):
+        if self._file is None:
+            return
+        self._lock.acquire()
+        try:
+            self._file.write('%s\n' % key)
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def read_ids(stream, journal):
+    """Yields the doc_ids read from the stream skipping those in the
+    journal.
+    """
+    for line in stream:
+        doc_id = line.split('\t')[0].strip()
+        if doc_id and doc_id not in journal:
+            yield doc_id
+
+
+def make_document(user, doc_id):
+    """Returns a [Document] object of the user with only the doc_id known."""
+    doc = scribd.Document(None, user)
+    try:
+        doc_id = int(doc_id)
+    except ValueError:
+        pass
+    doc._attributes['doc_id'] = doc_id
+    return doc
+
+
+def batches(iterable, size):
+    """Yields lists of up to "size" items of the iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+#
+# Commands
+#
+
+def cmd_export(user, options, args, journal):
+    fields = None
+    if options.fields:
+        fields = [name.strip() for name in options.fields.split(',')]
+    page_size = options.page_size
+    if page_size != 'auto':
+        page_size = int(page_size)
+    out = sys.stdout
+    if options.output:
+        out = open(options.output, 'ab')
+    if options.format == 'csv':
+        import csv
+        columns = fields or list(CSV_FIELDS)
+        writer = csv.writer(out)
+        if not journal.keys and (not options.output or not out.tell()):
+            writer.writerow(columns)
+        def write(attrs):
+            writer.writerow([_csv_value(attrs.get(name)) for name in columns])
+    elif options.format == 'jsonl':
+        import json
+        def write(attrs):
+            out.write(json.dumps(attrs, sort_keys=True) + '\n')
+    else:
+        raise SystemExit('unknown format: %s' % options.format)
+    progress = Progress('export')
+    try:
+        for doc in user.xall(page_size=page_size, fields=fields):
+            if doc.doc_id in journal:
+                continue
+            write(doc.get_attributes())
+            journal.add(doc.doc_id)
+            progress.add()
+    finally:
+        progress.finish()
+        if out is not sys.stdout:
+            out.close()
+    return progress
+
+
+def cmd_upload(user, options, args, journal):
+    if len(args) != 1:
+        raise SystemExit('upload takes a single DIRECTORY argument')
+    import fnmatch
+    directory = args[0]
+
+    def paths():
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                if fnmatch.fnmatch(name, options.pattern):
+                    path = os.path.join(root, name)
+                    if path not in journal:
+                        yield path
+
+    kwargs = {}
+    if options.access:
+        kwargs['access'] = options.access
+    progress = Progress('upload')
+    try:
+        for path, doc, error in scribd.upload_many(user, paths(), options.concurrency,
+                                                   **kwargs):
+            if error is not None:
+                sys.stderr.write('\n%s: %s\n' % (path, error))
+                progress.add(False)
+                continue
+            sys.stdout.write('%s\t%s\n' % (doc.doc_id, path))
+            sys.stdout.flush()
+            journal.add(path)
+            progress.add()
+    finally:
+        progress.finish()
+    return progress
+
+
+def cmd_update(user, options, args, journal):
+    fields = {}
+    for arg in args:
+        if '=' not in arg:
+            raise SystemExit('expected NAME=VALUE, got: %s' % arg)
+        name, value = arg.split('=', 1)
+        fields[name] = value
+    if not fields:
+        raise SystemExit('update needs at least one NAME=VALUE argument')
+
+    def update(batch):
+        scribd.update(batch, **fields)
+
+    progress = Progress('update')
+    docs = (make_document(user, doc_id) for doc_id in read_ids(sys.stdin, journal))
+    try:
+        # A single docs.changeSettings call updates a whole batch.
+        for batch, result, error in tasks.imap(update, batches(docs, options.batch_size),
+                                               options.concurrency):
+            if error is not None:
+                sys.stderr.write('\nbatch of %d: %s\n' % (len(batch), error))
+                progress.add(False, len(batch))
+                continue
+            for doc in batch:
+                journal.add(doc.doc_id)
+            progress.add(True, len(batch))
+    finally:
+        progress.finish()
+    return progress
+
+
+def cmd_delete(user, options, args, journal):
+    def delete(doc):
+        doc.delete()
+
+    progress = Progress('delete')
+    docs = (make_document(user, doc_id) for doc_id in read_ids(sys.stdin, journal))
+    try:
+        for doc, result, error in tasks.imap(delete, docs, options.concurrency):
+            if error is not None:
+                sys.stderr.write('\n%s: %s\n' % (doc.doc_id, error))
+                progress.add(False)
+                continue
+            journal.add(doc.doc_id)
+            progress.add()
+    finally:
+        progress.finish()
+    return progress
+
+
+def cmd_wait(user, options, args, journal):
+    docs = [make_document(user, doc_id) for doc_id in read_ids(sys.stdin, journal)]
+    progress = Progress('wait')
+    try:
+        for doc in scribd.wait_for_conversion(docs, options.timeout):
+            status = doc.conversion_status
+            sys.stdout.write('%s\t%s\n' % (doc.doc_id, status))
+            sys.stdout.flush()
+            journal.add(doc.doc_id)
+            progress.add(status != 'ERROR')
+    finally:
+        progress.finish()
+    progress.failed += len(docs) - progress.done - progress.failed
+    return progress
+
+
+COMMANDS = {
+    'export': cmd_export,
+    'upload': cmd_upload,
+    'update': cmd_update,
+    'delete': cmd_delete,
+    'wait': cmd_wait,
+}
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+
+def main(argv=None):
+    parser = OptionParser(usage=USAGE, prog='python -m scribd')
+    parser.add_option('--api-key', default=os.environ.get('SCRIBD_API_KEY'),
+                      help='API key (default: $SCRIBD_API_KEY)')
+    parser.add_option('--api-secret', default=os.environ.get('SCRIBD_API_SECRET'),
+                      help='API secret (default: $SCRIBD_API_SECRET)')
+    parser.add_option('--username',
+                      help='act as this user (password from $SCRIBD_PASSWORD)')
+    parser.add_option('--host', help='API host (default: %s)' % scribd.HOST)
+    parser.add_option('--port', type='int', help='API port (default: %d)' % scribd.PORT)
+    parser.add_option('-c', '--concurrency', type='int', default=4,
+                      help='number of concurrent API calls (default: 4)')
+    parser.add_option('--rate', type='float',
+                      help='maximal number of API calls per second')
+    parser.add_option('--upload-rate', type='float',
+                      help='maximal upload bandwidth in bytes per second')
+    parser.add_option('--resume', metavar='FILE',
+                      help='skip the items listed in FILE and add the processed ones')
+    parser.add_option('--format', default='jsonl',
+                      help='export: jsonl or csv (default: jsonl)')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='export: output file (default: stdout)')
+    parser.add_option('--fields',
+                      help='export: comma separated attribute names')
+    parser.add_option('--page-size', default='auto',
+                      help="export: documents per API call or 'auto' (default)")
+    parser.add_option('--pattern', default='*',
+                      help='upload: shell pattern of the file names (default: *)')
+    parser.add_option('--access', help='upload: public or private')
+    parser.add_option('--batch-size', type='int', default=100,
+                      help='update: documents changed by a single call (default: 100)')
+    parser.add_option('--timeout', type='float',
+                      help='wait: maximal number of seconds to wait')
+    options, args = parser.parse_args(argv)
+
+    if not args or args[0] not in COMMANDS:
+        parser.error('expected one of the commands: %s' % ', '.join(sorted(COMMANDS)))
+    if not options.api_key or not options.api_secret:
+        parser.error('the API key and secret are required')
+    scribd.config(options.api_key, options.api_secret)
+    if options.host:
+        scribd.HOST = options.host
+    if options.port:
+        scribd.PORT = options.port
+    if options.rate:
+        scribd.call_limiter = tasks.RateLimiter(options.rate)
+    if options.upload_rate:
+        scribd.upload_limiter = tasks.RateLimiter(options.upload_rate)
+
+    user = scribd.api_user
+    if options.username:
+        user = scribd.login(options.username, os.environ.get('SCRIBD_PASSWORD', ''))
+
+    journal = Journal(options.resume)
+    try:
+        progress = COMMANDS[args[0]](user, options, args[1:], journal)
+    finally:
+        journal.close()
+    if progress.failed:
+        return 1
+    return 0
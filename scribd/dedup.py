@@ -0,0 +1,187 @@
+"""
+Persistent index of uploaded file contents used to skip redundant uploads.
+
+The index maps a digest of the uploaded data to the document that was
+created from it. It is stored in an SQLite database and may be used by
+many threads and processes at once.
+
+Usage:
+
+    import scribd
+    from scribd.dedup import DedupIndex
+
+    scribd.dedup_index = DedupIndex('/var/cache/scribd-uploads.db')
+
+From now on, [User].upload() returns the already uploaded document if
+the same user uploads the same data again and [Document].replace() doesn't
+upload a revision identical to the current one.
+
+The upload parameters (access, doc_type etc.) are a part of the digest.
+The same data uploaded with different parameters is uploaded again and
+becomes a new document (or revision).
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import sqlite3
+from hashlib import sha1
+
+
+# Number of bytes read from the files at once while computing the digest.
+BLOCK_SIZE = 64 * 1024
+
+# Resource attributes of the uploaded documents stored in the index.
+ATTRIBUTES = ('doc_id', 'access_key', 'secret_password')
+
+
+class DedupIndex(object):
+    """An index of uploaded documents keyed by the digest of their data."""
+
+    def __init__(self, path, timeout=30.0):
+        """Opens the index, creating it if needed.
+
+        Parameters:
+          path
+            Path of the SQLite database file.
+          timeout
+            (optional) Number of seconds to wait for the database to be
+            unlocked by other processes.
+        """
+        self.path = path
+        self.timeout = timeout
+        db = self._connect()
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS documents ('
+                       'doc_id TEXT PRIMARY KEY, owner TEXT, digest TEXT, '
+                       'access_key TEXT, secret_password TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS documents_digest '
+                       'ON documents (owner, digest)')
+            db.commit()
+        finally:
+            db.close()
+
+    def _connect(self):
+        # A new connection is used for every operation. This makes the
+        # object safe to use from many threads and after a fork.
+        return sqlite3.connect(self.path, self.timeout)
+
+    def digest(self, file, params=None):
+        """Returns the hex digest of the data remaining in the file-alike
+        object. The data is read in blocks and the file position is
+        restored afterwards.
+
+        Parameters:
+          file
+            The file-alike object.
+          params
+            (optional) A dictionary of the upload parameters. Included in
+            the digest, None values are ignored.
+
+        Returns None if the file isn't seekable.
+        """
+        try:
+            pos = file.tell()
+        except (AttributeError, IOError, ValueError):
+            return None
+        h = sha1()
+        try:
+            while True:
+                data = file.read(BLOCK_SIZE)
+                if not data:
+                    break
+                h.update(data)
+        finally:
+            file.seek(pos)
+        for name, value in sorted((params or {}).items()):
+            if value is None:
+                continue
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            h.update('\0%s=%s' % (name, value))
+        return h.hexdigest()
+
+    def lookup(self, owner, digest):
+        """Returns a dictionary of resource attributes of the document
+        uploaded by the owner from data of the given digest or None
+        if there is no such document.
+        """
+        db = self._connect()
+        try:
+            row = db.execute('SELECT %s FROM documents WHERE owner=? AND digest=?' %
+                             ', '.join(ATTRIBUTES), (owner, digest)).fetchone()
+        finally:
+            db.close()
+        return _attributes(row)
+
+    def revision(self, doc_id):
+        """Returns the digest of the current data of the document or None
+        if the document is not in the index.
+        """
+        db = self._connect()
+        try:
+            row = db.execute('SELECT digest FROM documents WHERE doc_id=?',
+                             (str(doc_id),)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return str(row[0])
+
+    def get(self, doc_id):
+        """Returns a dictionary of the stored resource attributes of the
+        document or None if the document is not in the index.
+        """
+        db = self._connect()
+        try:
+            row = db.execute('SELECT %s FROM documents WHERE doc_id=?' %
+                             ', '.join(ATTRIBUTES), (str(doc_id),)).fetchone()
+        finally:
+            db.close()
+        return _attributes(row)
+
+    def record(self, owner, digest, attrs):
+        """Adds a document to the index or updates its digest.
+
+        Parameters:
+          owner
+            Identifier of the user owning the document.
+          digest
+            Digest of the data as returned by digest().
+          attrs
+            A dictionary of the document resource attributes. Must contain
+            the doc_id.
+        """
+        values = [attrs.get(name) for name in ATTRIBUTES]
+        values = [value is not None and str(value) or None for value in values]
+        db = self._connect()
+        try:
+            db.execute('INSERT OR REPLACE INTO documents (owner, digest, %s) '
+                       'VALUES (?, ?, %s)' % (', '.join(ATTRIBUTES),
+                                              ', '.join('?' * len(ATTRIBUTES))),
+                       [owner, digest] + values)
+            db.commit()
+        finally:
+            db.close()
+
+    def forget(self, doc_id):
+        """Removes a document from the index."""
+        db = self._connect()
+        try:
+            db.execute('DELETE FROM documents WHERE doc_id=?', (str(doc_id),))
+            db.commit()
+        finally:
+            db.close()
+
+
+def _attributes(row):
+    # Converts a row of ATTRIBUTES values to a dictionary.
+    if row is None:
+        return None
+    attrs = {}
+    for name, value in zip(ATTRIBUTES, row):
+        if value is not None:
+            attrs[name] = str(value)
+    if attrs['doc_id'].isdigit():
+        attrs['doc_id'] = int(attrs['doc_id'])
+    return attrs
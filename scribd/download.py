@@ -0,0 +1,267 @@
+"""
+Downloads files over HTTP straight to disk.
+
+Files are streamed in blocks, split into parallel HTTP Range requests
+if the server supports them and resumed if a previous download was
+interrupted. A download is resumed only if the server reports the same
+validator (ETag or Last-Modified) as when it was started; the resuming
+requests carry it in the If-Range header so a file changed in the
+meantime is downloaded again from the start.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import os
+import re
+import httplib
+import urlparse
+
+from scribd import tasks
+
+
+# Number of bytes read from the network and written to disk at once.
+BLOCK_SIZE = 64 * 1024
+
+# Files are split into parts not smaller than this many bytes.
+MIN_PART_SIZE = 4 * 1024 * 1024
+
+# Maximal number of redirects followed.
+MAX_REDIRECTS = 5
+
+_content_range_re = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadError(IOError):
+    """Exception raised if a file cannot be downloaded."""
+
+
+def download(url, path, parts=4, timeout=None, connect_timeout=None):
+    """Downloads a file.
+
+    Parameters:
+      url
+        HTTP or HTTPS URL of the file.
+      path
+        Destination path. While the download is in progress, the data is
+        stored in files named like the destination but with ".part"
+        (".part0", ".part1", ... if the file is split) extension added.
+        These files are used to resume the download if it's interrupted.
+        The validator of the file is kept in a file with ".validator"
+        extension added.
+      parts
+        (optional) Maximal number of parallel Range requests the file
+        is split into. Used only if the server supports ranges and the
+        file is large enough. Every part is at least MIN_PART_SIZE bytes.
+      timeout
+        (optional) Socket timeout of the reads in seconds.
+      connect_timeout
+        (optional) Number of seconds to wait for a connection to be
+        opened. Defaults to "timeout".
+
+    Returns:
+        The destination path.
+    """
+    if connect_timeout is None:
+        connect_timeout = timeout
+    timeouts = (connect_timeout, timeout)
+    url, length, ranges, validator = _probe(url, timeouts)
+    count = 1
+    if ranges and length:
+        count = max(1, min(parts, length // MIN_PART_SIZE))
+    if count == 1:
+        end = None
+        if length:
+            end = length - 1
+        segments = [(path + '.part', 0, end, ranges)]
+    else:
+        size = length // count
+        segments = []
+        for i in xrange(count):
+            start = i * size
+            end = start + size - 1
+            if i == count - 1:
+                end = length - 1
+            segments.append(('%s.part%d' % (path, i), start, end, ranges))
+
+    # The parts left by an interrupted download are used only if they
+    # hold the same version of the file.
+    info = path + '.validator'
+    if validator is None or _read_validator(info) != validator:
+        _remove_parts(path)
+        if os.path.exists(info):
+            os.remove(info)
+        if validator is not None:
+            file = open(info, 'wb')
+            try:
+                file.write(validator)
+            finally:
+                file.close()
+
+    def fetch(segment):
+        _fetch(url, timeouts, validator, *segment)
+
+    for segment, result, error in tasks.imap(fetch, segments, count):
+        if error is not None:
+            raise error
+
+    if count == 1:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(segments[0][0], path)
+    else:
+        out = open(path, 'wb')
+        try:
+            for segment in segments:
+                part = open(segment[0], 'rb')
+                try:
+                    while True:
+                        data = part.read(BLOCK_SIZE)
+                        if not data:
+                            break
+                        out.write(data)
+                finally:
+                    part.close()
+        finally:
+            out.close()
+        for segment in segments:
+            os.remove(segment[0])
+    if os.path.exists(info):
+        os.remove(info)
+    return path
+
+
+def _read_validator(path):
+    # Returns the validator stored by download() or None.
+    if not os.path.exists(path):
+        return None
+    file = open(path, 'rb')
+    try:
+        return file.read()
+    finally:
+        file.close()
+
+
+def _remove_parts(path):
+    # Removes the part files of the destination path.
+    directory, name = os.path.split(path)
+    prefix = name + '.part'
+    for entry in os.listdir(directory or os.curdir):
+        if entry == prefix or (entry.startswith(prefix) and entry[len(prefix):].isdigit()):
+            os.remove(os.path.join(directory, entry))
+
+
+def _fetch(url, timeouts, validator, path, start, end, ranges):
+    # Downloads bytes from "start" to "end" (inclusive, None means till
+    # the end of the file) to the file at "path". Data already stored
+    # in the file is not downloaded again if the server supports ranges
+    # and the file still matches the validator.
+    have = 0
+    if os.path.exists(path):
+        have = os.path.getsize(path)
+    if end is not None and have >= end - start + 1:
+        return
+    headers = {}
+    if ranges or have:
+        if end is None:
+            headers['Range'] = 'bytes=%d-' % (start + have)
+        else:
+            headers['Range'] = 'bytes=%d-%d' % (start + have, end)
+        if validator is not None:
+            headers['If-Range'] = validator
+    conn, resp = _request('GET', url, headers, timeouts)
+    try:
+        if resp.status == 416 and have and end is None:
+            # The file is already complete.
+            return
+        if resp.status == 200:
+            if start or (end is not None and resp.length != end - start + 1):
+                raise DownloadError('server ignored the range request or the file '
+                                    'changed: %s' % url)
+            # The whole file is being sent (the file changed or the server
+            # doesn't support ranges), start from scratch.
+            mode = 'wb'
+        elif resp.status == 206:
+            match = _content_range_re.match(resp.getheader('Content-Range', ''))
+            if match is None or int(match.group(1)) != start + have:
+                raise DownloadError('unexpected content range: %s' % url)
+            mode = 'ab'
+        else:
+            raise DownloadError('HTTP error %d %s: %s' % (resp.status, resp.reason, url))
+        expected = resp.getheader('Content-Length', None)
+        received = 0
+        file = open(path, mode)
+        try:
+            while True:
+                data = resp.read(BLOCK_SIZE)
+                if not data:
+                    break
+                file.write(data)
+                received += len(data)
+        finally:
+            file.close()
+        # The response ends early without an error if the connection
+        # is closed. The data received so far is kept for resuming.
+        if expected is not None and received != int(expected):
+            raise DownloadError('connection closed before the end of data: %s' % url)
+    finally:
+        conn.close()
+
+
+def _probe(url, timeouts):
+    # Returns a (url, length, ranges, validator) tuple where "url" is the
+    # URL after following the redirects, "length" is the file size (None
+    # if unknown), "ranges" is True if the server accepts Range requests
+    # and "validator" is the strong ETag or the Last-Modified date of the
+    # file usable in If-Range headers (None if unknown).
+    try:
+        conn, resp = _request('HEAD', url, {}, timeouts)
+    except DownloadError:
+        raise
+    except Exception:
+        return url, None, False, None
+    conn.close()
+    if resp.status != 200:
+        # Some servers (e.g. with presigned URLs) allow GET requests only.
+        return resp.url, None, False, None
+    length = resp.getheader('Content-Length', None)
+    if length is not None:
+        length = int(length)
+    ranges = resp.getheader('Accept-Ranges', 'none').lower() == 'bytes'
+    # Weak ETags can't be used in If-Range.
+    validator = resp.getheader('ETag', None)
+    if validator is None or validator.startswith('W/'):
+        validator = resp.getheader('Last-Modified', None)
+    return resp.url, length, ranges, validator
+
+
+def _request(method, url, headers, timeouts):
+    # Performs an HTTP request following the redirects. Returns
+    # a (connection, response) tuple. The response object has an extra
+    # "url" attribute set to the final URL. "timeouts" is a (connect,
+    # read) tuple of socket timeouts.
+    connect_timeout, read_timeout = timeouts
+    for i in xrange(MAX_REDIRECTS + 1):
+        scheme, netloc, path, params, query, fragment = urlparse.urlparse(url)
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=connect_timeout)
+        elif scheme == 'http':
+            conn = httplib.HTTPConnection(netloc, timeout=connect_timeout)
+        else:
+            raise DownloadError('unsupported URL: %s' % url)
+        selector = urlparse.urlunparse(('', '', path or '/', params, query, ''))
+        try:
+            conn.connect()
+            conn.sock.settimeout(read_timeout)
+            conn.request(method, selector, headers=headers)
+            resp = conn.getresponse()
+        except:
+            conn.close()
+            raise
+        if resp.status in (301, 302, 303, 307) and resp.getheader('Location'):
+            conn.close()
+            url = urlparse.urljoin(url, resp.getheader('Location'))
+            continue
+        resp.url = url
+        return conn, resp
+    raise DownloadError('too many redirects: %s' % url)
@@ -0,0 +1,626 @@
+"""
+A local stand-in for the Scribd API server.
+
+The server speaks the same multipart/form-data protocol as the HOST,
+verifies the api_sig of every call and serves realistic responses from
+an in-memory document store. It is meant for tests, benchmarks and load
+tests of applications using the library. Latency, internal server errors
+and throttling can be injected.
+
+Supported methods:
+  docs.upload, docs.getList, docs.search, docs.getSettings,
+  docs.changeSettings, docs.getConversionStatus, docs.getDownloadUrl,
+  docs.delete
+
+The links returned by docs.getDownloadUrl point to the server itself,
+which serves the uploaded data with ETag and Last-Modified validators
+and, unless disabled, HTTP Range support. Truncated bodies can be
+injected to test the clients' handling of broken connections.
+
+Usage:
+
+    from scribd.fakeserver import FakeServer
+
+    server = FakeServer(api_key='key', api_secret='secret')
+    server.start()
+    server.configure_client() # Points the scribd library to the server.
+    ...
+    server.stop()
+
+or from the command line:
+
+    python -m scribd.fakeserver --port 8080 --latency 0.05
+
+Real traffic can be recorded with the Recorder class and replayed by
+passing the recording to the server:
+
+    from scribd.fakeserver import Recorder
+
+    recorder = Recorder('traffic.jsonl')
+    recorder.install()
+    ... # Perform the API calls against the real HOST.
+    recorder.uninstall()
+
+    server = FakeServer(api_key, api_secret, recording='traffic.jsonl')
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import re
+import cgi
+import json
+import random
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from email.utils import formatdate
+from hashlib import md5
+from xml.sax.saxutils import escape
+
+import scribd
+
+
+# Error codes reported by the server.
+ERR_INVALID_KEY = 400
+ERR_INVALID_SIGNATURE = 403
+ERR_UNKNOWN_METHOD = 405
+ERR_MISSING_ARGUMENT = 406
+ERR_NOT_FOUND = 404
+
+# Resource attributes of the uploaded documents.
+_integer_attributes = ('doc_id', 'page_count', 'reads')
+
+# Fields ignored when recorded calls are matched.
+_volatile_fields = ('api_key', 'api_sig', 'session_key', 'file')
+
+# Path of the download links, "/download/<doc_id>/<name>".
+_download_re = re.compile(r'/download/(\d+)/')
+
+_range_re = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class Document(object):
+    """A document kept by the server."""
+
+    def __init__(self, doc_id, name, data, conversion_time):
+        size = len(data)
+        self.attrs = {'doc_id': doc_id,
+                      'title': name.rsplit('.', 1)[0],
+                      'description': '',
+                      'tags': '',
+                      'access': 'public',
+                      'license': 'by-nc',
+                      'show_ads': 'default',
+                      'access_key': 'key-%016x' % random.getrandbits(64),
+                      'secret_password': '%012x' % random.getrandbits(48),
+                      'page_count': max(1, size // 3000),
+                      'reads': 0,
+                      'thumbnail_url': 'http://i.scribd.com/public/images/uploaded/%d/thumb.jpg' % doc_id}
+        self.name = name
+        self.data = data
+        self.size = size
+        self.modified = time.time()
+        self.converted_at = time.time() + conversion_time
+
+    def etag(self):
+        return '"%s"' % md5(self.data).hexdigest()
+
+    def last_modified(self):
+        return formatdate(self.modified, usegmt=True)
+
+    def conversion_status(self):
+        if time.time() >= self.converted_at:
+            return 'DONE'
+        return 'PROCESSING'
+
+    def toxml(self, names=None):
+        attrs = dict(self.attrs, conversion_status=self.conversion_status())
+        if names is None:
+            names = sorted(attrs)
+        return ''.join(_element(name, attrs[name]) for name in names if name in attrs)
+
+
+class Store(object):
+    """In-memory document store of the server."""
+
+    def __init__(self, conversion_time=0.0):
+        self.conversion_time = conversion_time
+        self.documents = {} # doc_id -> Document
+        self.next_id = 1000000
+        self.base_url = None # Of the download links, set by FakeServer.start().
+        self.lock = threading.Lock()
+
+    def upload(self, name, data, fields):
+        self.lock.acquire()
+        try:
+            if 'rev_id' in fields:
+                doc_id = int(fields['rev_id'])
+                if doc_id not in self.documents:
+                    raise _Fail(ERR_NOT_FOUND, 'Document not found')
+            else:
+                doc_id = self.next_id
+                self.next_id += 1
+            doc = Document(doc_id, name, data, self.conversion_time)
+            if 'access' in fields:
+                doc.attrs['access'] = fields['access']
+            old = self.documents.get(doc_id)
+            if old is not None:
+                # Revisions keep the settings of the document.
+                doc.attrs.update((k, v) for k, v in old.attrs.items()
+                                 if k not in ('page_count', 'thumbnail_url'))
+            self.documents[doc_id] = doc
+            return doc
+        finally:
+            self.lock.release()
+
+    def get(self, doc_id):
+        try:
+            return self.documents[int(doc_id)]
+        except (KeyError, ValueError):
+            raise _Fail(ERR_NOT_FOUND, 'Document not found')
+
+    def listing(self):
+        self.lock.acquire()
+        try:
+            docs = self.documents.values()
+        finally:
+            self.lock.release()
+        docs.sort(key=lambda doc: -doc.attrs['doc_id'])
+        return docs
+
+
+class FakeServer(object):
+    """The fake API server. Runs in background threads."""
+
+    def __init__(self, api_key='key', api_secret='secret', host='127.0.0.1',
+                 port=0, latency=0.0, error_rate=0.0, max_rate=None,
+                 conversion_time=0.0, recording=None, ranges=True, truncate=None):
+        """Instantiates a new server.
+
+        Parameters:
+          api_key, api_secret
+            (optional) API key and secret the calls have to be signed with.
+          host, port
+            (optional) Address to listen on. By default, a free port on
+            the loopback interface is chosen. The actual port is available
+            as the "port" attribute after start().
+          latency
+            (optional) Number of seconds every call is delayed by or
+            a (min, max) tuple to choose a random delay.
+          error_rate
+            (optional) Fraction of the calls that fail with an HTTP 500
+            error.
+          max_rate
+            (optional) Maximal number of calls per second. Calls above
+            the limit fail with an HTTP 503 error.
+          conversion_time
+            (optional) Number of seconds the conversion of an uploaded
+            document takes.
+          recording
+            (optional) Path of a file created by the Recorder. Recorded
+            calls are answered with the recorded responses. Other calls
+            are served from the document store.
+          ranges
+            (optional) If False, the download links ignore the Range
+            headers and don't advertise Accept-Ranges.
+          truncate
+            (optional) Number of bytes of every download response body
+            sent before the connection is closed. The Content-Length
+            header still announces the whole body.
+        """
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.ranges = ranges
+        self.truncate = truncate
+        self.store = Store(conversion_time)
+        self.calls = {} # method -> number of calls
+        self.downloads = [] # (method, Range header) of the download requests
+        self._window = [] # times of the calls in the last second
+        self._lock = threading.Lock()
+        self._recorded = {}
+        if recording is not None:
+            self.load_recording(recording)
+        self._server = None
+
+    def start(self):
+        """Starts serving in a background thread."""
+        class Handler(_Handler):
+            fake = self
+        self._server = _HTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self.store.base_url = 'http://%s:%d' % (self.host, self.port)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        """Stops serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def configure_client(self):
+        """Points the scribd library to this server and configures
+        the API key and secret.
+        """
+        scribd.HOST = self.host
+        scribd.PORT = self.port
+        scribd.config(self.api_key, self.api_secret)
+
+    def load_recording(self, path):
+        """Loads calls recorded by the Recorder."""
+        file = open(path)
+        try:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = _call_key(entry['fields'])
+                    self._recorded[key] = entry
+        finally:
+            file.close()
+
+    def handle(self, fields):
+        """Performs an API call and returns a (status, body) tuple."""
+        self._lock.acquire()
+        try:
+            method = fields.get('method', '')
+            self.calls[method] = self.calls.get(method, 0) + 1
+            throttled = False
+            if self.max_rate is not None:
+                now = time.time()
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.max_rate:
+                    throttled = True
+                else:
+                    self._window.append(now)
+        finally:
+            self._lock.release()
+
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+        if throttled:
+            return 503, ''
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, ''
+
+        entry = self._recorded.get(_call_key(fields))
+        if entry is not None:
+            return entry['status'], entry['body'].encode('utf8')
+        try:
+            self._check_signature(fields)
+            function = _methods.get(method)
+            if function is None:
+                raise _Fail(ERR_UNKNOWN_METHOD, 'Unknown method: %s' % method)
+            body = function(self.store, fields)
+        except _Fail, err:
+            return 200, ('<?xml version="1.0" encoding="UTF-8"?>\n<rsp stat="fail">'
+                         '<error code="%d" message="%s"/></rsp>' %
+                         (err.code, escape(err.message, {'"': '&quot;'})))
+        return 200, '<?xml version="1.0" encoding="UTF-8"?>\n<rsp stat="ok">%s</rsp>' % body
+
+    def serve(self, method, path, headers):
+        """Answers a GET or HEAD request of a download link. Returns
+        a (status, headers, body) tuple, "headers" is a list of (name,
+        value) tuples.
+        """
+        self._lock.acquire()
+        try:
+            self.downloads.append((method, headers.get('Range')))
+        finally:
+            self._lock.release()
+        match = _download_re.match(path)
+        doc = None
+        if match is not None:
+            doc = self.store.documents.get(int(match.group(1)))
+        if doc is None:
+            return 404, [], ''
+        data = doc.data
+        etag = doc.etag()
+        last_modified = doc.last_modified()
+        resp_headers = [('Content-Type', 'application/octet-stream'),
+                        ('ETag', etag), ('Last-Modified', last_modified)]
+        if not self.ranges:
+            return 200, resp_headers, data
+        resp_headers.append(('Accept-Ranges', 'bytes'))
+        match = _range_re.match(headers.get('Range', ''))
+        if match is None or headers.get('If-Range', etag) not in (etag, last_modified):
+            # No range or the client's copy is outdated, send everything.
+            return 200, resp_headers, data
+        start = int(match.group(1))
+        end = len(data) - 1
+        if match.group(2):
+            end = min(end, int(match.group(2)))
+        if start > end:
+            return 416, resp_headers + [('Content-Range', 'bytes */%d' % len(data))], ''
+        resp_headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data))))
+        return 206, resp_headers, data[start:end + 1]
+
+    def _check_signature(self, fields):
+        if fields.get('api_key') != self.api_key:
+            raise _Fail(ERR_INVALID_KEY, 'Invalid API key')
+        items = [(k, v) for k, v in fields.items() if k not in ('api_sig', 'file')]
+        items.sort()
+        sign = md5(self.api_secret + ''.join(k + v for k, v in items)).hexdigest()
+        if fields.get('api_sig') != sign:
+            raise _Fail(ERR_INVALID_SIGNATURE, 'Invalid API signature')
+
+
+class Recorder(object):
+    """Records the API calls performed by the library and the HOST's
+    responses to a file that can be replayed by the FakeServer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._original = None
+
+    def install(self):
+        """Starts recording."""
+        self._original = scribd.post_multipart
+        def post_multipart(host, selector, fields=(), headers=None, port=None, pool=None,
+                           connect_timeout=None, read_timeout=None):
+            resp = self._original(host, selector, fields, headers, port, pool,
+                                  connect_timeout, read_timeout)
+            self._record(fields, resp)
+            return resp
+        scribd.post_multipart = post_multipart
+
+    def uninstall(self):
+        """Stops recording."""
+        if self._original is not None:
+            scribd.post_multipart = self._original
+            self._original = None
+
+    def _record(self, fields, resp):
+        recorded = {}
+        for name, value in fields:
+            if isinstance(value, tuple):
+                value = value[1] # Only the name of a file is kept.
+            recorded[name] = value
+        status = int(resp.getheader('Status', str(resp.status)).split()[0])
+        entry = {'fields': recorded, 'status': status,
+                 'body': resp.body.decode('utf8', 'replace')}
+        self._lock.acquire()
+        try:
+            file = open(self.path, 'a')
+            try:
+                file.write(json.dumps(entry, sort_keys=True) + '\n')
+            finally:
+                file.close()
+        finally:
+            self._lock.release()
+
+
+#
+# Methods
+#
+
+class _Fail(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, code, message)
+        self.code = code
+        self.message = message
+
+
+def _required(fields, name):
+    try:
+        return fields[name]
+    except KeyError:
+        raise _Fail(ERR_MISSING_ARGUMENT, 'Missing argument: %s' % name)
+
+
+def _upload(store, fields):
+    name, data = _required(fields, 'file')
+    doc = store.upload(name, data, fields)
+    return doc.toxml(('doc_id', 'access_key', 'secret_password'))
+
+
+def _get_list(store, fields):
+    limit = int(fields.get('limit', 1000))
+    offset = int(fields.get('offset', 0))
+    docs = store.listing()[offset:offset + limit]
+    names = ('doc_id', 'title', 'description', 'access_key', 'secret_password',
+             'conversion_status', 'page_count', 'thumbnail_url', 'tags', 'reads')
+    return '<resultset list="true">%s</resultset>' % \
+        ''.join('<result>%s</result>' % doc.toxml(names) for doc in docs)
+
+
+def _search(store, fields):
+    words = _required(fields, 'query').lower().split()
+    limit = int(fields.get('num_results', 10))
+    offset = int(fields.get('num_start', 0))
+    found = []
+    for doc in store.listing():
+        text = ' '.join([doc.attrs['title'], doc.attrs['description'],
+                         doc.attrs['tags']]).lower()
+        if [word for word in words if word in text] == words:
+            found.append(doc)
+    page = found[offset:offset + limit]
+    names = ('doc_id', 'title', 'description', 'tags', 'access_key',
+             'page_count', 'thumbnail_url', 'reads')
+    return ('<result_set totalResultsAvailable="%d" totalResultsReturned="%d" '
+            'firstResultPosition="%d" list="true">%s</result_set>' %
+            (len(found), len(page), offset + 1,
+             ''.join('<result>%s</result>' % doc.toxml(names) for doc in page)))
+
+
+def _get_settings(store, fields):
+    doc = store.get(_required(fields, 'doc_id'))
+    return doc.toxml(('doc_id', 'title', 'description', 'access', 'license',
+                      'tags', 'show_ads', 'access_key', 'secret_password',
+                      'thumbnail_url'))
+
+
+def _change_settings(store, fields):
+    docs = [store.get(doc_id) for doc_id in _required(fields, 'doc_ids').split(',')]
+    for name in ('title', 'description', 'access', 'license', 'tags', 'show_ads'):
+        if name in fields:
+            for doc in docs:
+                doc.attrs[name] = fields[name]
+    return ''
+
+
+def _get_conversion_status(store, fields):
+    doc = store.get(_required(fields, 'doc_id'))
+    return _element('conversion_status', doc.conversion_status())
+
+
+def _get_download_url(store, fields):
+    doc = store.get(_required(fields, 'doc_id'))
+    doc_type = fields.get('doc_type', 'original')
+    name = doc.name
+    if doc_type != 'original':
+        name = '%s.%s' % (doc.attrs['title'], doc_type)
+    return _element('download_link', '%s/download/%d/%s' %
+                    (store.base_url, doc.attrs['doc_id'], name))
+
+
+def _delete(store, fields):
+    doc = store.get(_required(fields, 'doc_id'))
+    store.lock.acquire()
+    try:
+        store.documents.pop(doc.attrs['doc_id'], None)
+    finally:
+        store.lock.release()
+    return ''
+
+
+_methods = {
+    'docs.upload': _upload,
+    'docs.getList': _get_list,
+    'docs.search': _search,
+    'docs.getSettings': _get_settings,
+    'docs.changeSettings': _change_settings,
+    'docs.getConversionStatus': _get_conversion_status,
+    'docs.getDownloadUrl': _get_download_url,
+    'docs.delete': _delete,
+}
+
+
+#
+# HTTP
+#
+
+def _element(name, value):
+    if name in _integer_attributes:
+        return '<%s type="integer">%d</%s>' % (name, value, name)
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return '<%s><![CDATA[%s]]></%s>' % (name, value, name)
+
+
+def _call_key(fields):
+    # Returns a hashable key identifying a call for replaying.
+    items = []
+    for name, value in fields.items():
+        if name not in _volatile_fields:
+            if isinstance(value, unicode):
+                value = value.encode('utf8')
+            items.append((str(name), value))
+    items.sort()
+    return tuple(items)
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # The response is written in pieces.
+    fake = None # Set to the FakeServer object.
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        form = cgi.FieldStorage(fp=StringIO(data), headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST',
+                                         'CONTENT_TYPE': self.headers.get('Content-Type', ''),
+                                         'CONTENT_LENGTH': str(length)})
+        fields = {}
+        if form.list:
+            for item in form.list:
+                if item.filename:
+                    fields[item.name] = (item.filename, item.value)
+                else:
+                    fields[item.name] = item.value
+        status, body = self.fake.handle(fields)
+        self.send_response(status)
+        self.send_header('Status', str(status))
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._serve_file('GET')
+
+    def do_HEAD(self):
+        self._serve_file('HEAD')
+
+    def _serve_file(self, method):
+        status, headers, body = self.fake.serve(method, self.path, self.headers)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if method == 'HEAD':
+            return
+        truncate = self.fake.truncate
+        if truncate is not None and truncate < len(body):
+            self.wfile.write(body[:truncate])
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--api-key', default='key')
+    parser.add_option('--api-secret', default='secret')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds every call is delayed by')
+    parser.add_option('--error-rate', type='float', default=0.0,
+                      help='fraction of calls failing with HTTP 500')
+    parser.add_option('--max-rate', type='float', default=None,
+                      help='calls per second above which HTTP 503 is returned')
+    parser.add_option('--conversion-time', type='float', default=0.0,
+                      help='seconds the conversion of a document takes')
+    parser.add_option('--recording', help='replay calls recorded in this file')
+    options, args = parser.parse_args()
+    server = FakeServer(options.api_key, options.api_secret, options.host,
+                        options.port, options.latency, options.error_rate,
+                        options.max_rate, options.conversion_time, options.recording)
+    server.start()
+    print 'Fake Scribd API listening on http://%s:%d%s' % (server.host, server.port,
+                                                           scribd.REQUEST_PATH)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
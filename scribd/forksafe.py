@@ -0,0 +1,51 @@
+"""
+Rebuilds the per-process state of the library after a fork.
+
+Objects holding sockets, locks or other state that must not be shared
+between processes register themselves here. After a fork, their
+_after_fork() method is called in the child process so they can drop
+the inherited state. Read-only state is left alone and is shared with
+the parent using copy-on-write.
+
+If the os.register_at_fork() function is available, the objects are
+notified right after the fork. Otherwise the process ID is compared
+every time check() is called, which the library does before using the
+registered objects.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import os
+from weakref import WeakSet
+
+
+_pid = os.getpid()
+_objects = WeakSet()
+
+
+def register(obj):
+    """Registers an object whose _after_fork() method is called in the
+    child process after a fork. Only a weak reference to the object
+    is kept.
+    """
+    _objects.add(obj)
+
+
+def check():
+    """Notifies the registered objects if the current process is
+    a forked child that hasn't done it yet.
+    """
+    if os.getpid() != _pid:
+        _after_fork()
+
+
+def _after_fork():
+    global _pid
+    _pid = os.getpid()
+    for obj in list(_objects):
+        obj._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,317 @@
+"""
+Collects metrics of the API calls performed by the library.
+
+Metrics are disabled by default and cost almost nothing until enabled:
+
+    from scribd import metrics
+
+    metrics.enable()
+    ...
+    print metrics.prometheus_text()
+
+For every API method, the number of calls, errors (by error code),
+retries, request and response bytes and a latency histogram are kept.
+Caches used by the library report their hits and misses too.
+
+Every finished call is also reported as an event (a dictionary) to the
+listeners added with add_listener(), for example a JSONLSink object
+writing the events to a file.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import threading
+from time import time
+
+from scribd import forksafe
+
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# True if the metrics are being collected. Use enable() and disable().
+enabled = False
+
+
+class CallStats(object):
+    """Statistics of a single API call, filled in while it's performed."""
+
+    def __init__(self, method):
+        self.method = method
+        self.start = time()
+        self.duration = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.error = None # Error code or exception class name.
+
+    def event(self):
+        """Returns the statistics as a dictionary."""
+        return {'time': self.start,
+                'method': self.method,
+                'duration': self.duration,
+                'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes,
+                'retries': self.retries,
+                'error': self.error}
+
+
+class _MethodMetrics(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = {} # error -> count
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+
+
+class Registry(object):
+    """Keeps the collected metrics. Can be used by many threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # A child process reports its own calls only.
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears all metrics."""
+        self._lock.acquire()
+        try:
+            self._methods = {} # method -> _MethodMetrics
+            self._caches = {} # cache name -> [hits, misses]
+            self._counters = {} # name -> value
+        finally:
+            self._lock.release()
+
+    def record(self, stats):
+        """Adds a finished call described by a CallStats object."""
+        duration = stats.duration
+        index = 0
+        for bound in LATENCY_BUCKETS:
+            if duration <= bound:
+                break
+            index += 1
+        self._lock.acquire()
+        try:
+            m = self._methods.get(stats.method)
+            if m is None:
+                m = self._methods[stats.method] = _MethodMetrics()
+            m.calls += 1
+            if stats.error is not None:
+                m.errors[stats.error] = m.errors.get(stats.error, 0) + 1
+            m.retries += stats.retries
+            m.request_bytes += stats.request_bytes
+            m.response_bytes += stats.response_bytes
+            m.buckets[index] += 1
+            m.duration_sum += duration
+        finally:
+            self._lock.release()
+
+    def cache(self, name, hit):
+        """Counts a hit (if "hit" is True) or a miss of the named cache."""
+        self._lock.acquire()
+        try:
+            counts = self._caches.get(name)
+            if counts is None:
+                counts = self._caches[name] = [0, 0]
+            counts[not hit] += 1
+        finally:
+            self._lock.release()
+
+    def count(self, name, value=1):
+        """Increments a named counter."""
+        self._lock.acquire()
+        try:
+            self._counters[name] = self._counters.get(name, 0) + value
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """Returns a dictionary with the current metrics.
+
+        Keys:
+          methods
+            A dictionary mapping the method names to dictionaries with
+            "calls", "errors", "retries", "request_bytes", "response_bytes",
+            "duration_sum" and "buckets" (a list of (upper bound, count)
+            tuples, not cumulative, the last bound is None) keys.
+          caches
+            A dictionary mapping the cache names to dictionaries with
+            "hits", "misses" and "hit_ratio" keys.
+          counters
+            A dictionary of the named counters.
+        """
+        self._lock.acquire()
+        try:
+            methods = {}
+            for method, m in self._methods.items():
+                methods[method] = {'calls': m.calls,
+                                   'errors': m.errors.copy(),
+                                   'retries': m.retries,
+                                   'request_bytes': m.request_bytes,
+                                   'response_bytes': m.response_bytes,
+                                   'duration_sum': m.duration_sum,
+                                   'buckets': zip(LATENCY_BUCKETS + (None,), m.buckets)}
+            caches = {}
+            for name, (hits, misses) in self._caches.items():
+                ratio = 0.0
+                if hits + misses:
+                    ratio = float(hits) / (hits + misses)
+                caches[name] = {'hits': hits, 'misses': misses, 'hit_ratio': ratio}
+            counters = self._counters.copy()
+        finally:
+            self._lock.release()
+        return {'methods': methods, 'caches': caches, 'counters': counters}
+
+    def prometheus_text(self, prefix='scribd'):
+        """Returns the metrics in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        def metric(name, type, help, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, type))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+                if label_text:
+                    label_text = '{%s}' % label_text
+                lines.append('%s_%s%s %s' % (prefix, name, label_text, _number(value)))
+        methods = sorted(snap['methods'].items())
+        metric('api_calls_total', 'counter', 'Number of API calls.',
+               [((('method', k),), m['calls']) for k, m in methods])
+        metric('api_errors_total', 'counter', 'Number of failed API calls.',
+               [((('method', k), ('code', e)), n) for k, m in methods
+                for e, n in sorted(m['errors'].items())])
+        metric('api_retries_total', 'counter', 'Number of retried requests.',
+               [((('method', k),), m['retries']) for k, m in methods])
+        metric('api_request_bytes_total', 'counter', 'Bytes sent to the API.',
+               [((('method', k),), m['request_bytes']) for k, m in methods])
+        metric('api_response_bytes_total', 'counter', 'Bytes received from the API.',
+               [((('method', k),), m['response_bytes']) for k, m in methods])
+        lines.append('# HELP %s_api_call_duration_seconds Duration of API calls.' % prefix)
+        lines.append('# TYPE %s_api_call_duration_seconds histogram' % prefix)
+        for k, m in methods:
+            total = 0
+            for bound, n in m['buckets']:
+                total += n
+                le = '+Inf'
+                if bound is not None:
+                    le = repr(bound)
+                lines.append('%s_api_call_duration_seconds_bucket{method="%s",le="%s"} %d' %
+                             (prefix, _escape(k), le, total))
+            lines.append('%s_api_call_duration_seconds_sum{method="%s"} %s' %
+                         (prefix, _escape(k), _number(m['duration_sum'])))
+            lines.append('%s_api_call_duration_seconds_count{method="%s"} %d' %
+                         (prefix, _escape(k), m['calls']))
+        caches = sorted(snap['caches'].items())
+        metric('cache_requests_total', 'counter', 'Cache lookups by result.',
+               [((('cache', k), ('result', 'hit')), c['hits']) for k, c in caches] +
+               [((('cache', k), ('result', 'miss')), c['misses']) for k, c in caches])
+        for name, value in sorted(snap['counters'].items()):
+            metric(name, 'counter', 'Library counter.', [((), value)])
+        return '\n'.join(lines) + '\n'
+
+
+class JSONLSink(object):
+    """A listener writing the call events to a file, one JSON object
+    per line.
+    """
+
+    def __init__(self, path):
+        import json
+        self._dumps = json.dumps
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = self._dumps(event, sort_keys=True) + '\n'
+        self._lock.acquire()
+        try:
+            file = open(self.path, 'a')
+            try:
+                file.write(line)
+            finally:
+                file.close()
+        finally:
+            self._lock.release()
+
+
+# The registry used by the library.
+registry = Registry()
+
+# Callables called with an event dictionary (see CallStats.event())
+# after every API call.
+listeners = []
+
+
+def enable():
+    """Starts collecting metrics."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stops collecting metrics. The collected metrics are kept."""
+    global enabled
+    enabled = False
+
+
+def add_listener(listener):
+    """Adds a callable called with an event dictionary after every API
+    call. Use a JSONLSink object to write the events to a file.
+    """
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Removes a listener added by add_listener()."""
+    listeners.remove(listener)
+
+
+def record(stats):
+    """Records a finished call described by a CallStats object."""
+    stats.duration = time() - stats.start
+    registry.record(stats)
+    if listeners:
+        event = stats.event()
+        for listener in list(listeners):
+            listener(event)
+
+
+def cache(name, hit):
+    """Counts a hit or a miss of the named cache if metrics are enabled."""
+    if enabled:
+        registry.cache(name, hit)
+
+
+def count(name, value=1):
+    """Increments a named counter if metrics are enabled."""
+    if enabled:
+        registry.count(name, value)
+
+
+def snapshot():
+    """Returns the current metrics. Refer to Registry.snapshot()."""
+    return registry.snapshot()
+
+
+def prometheus_text(prefix='scribd'):
+    """Returns the metrics in the Prometheus text exposition format."""
+    return registry.prometheus_text(prefix)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -9,13 +9,221 @@ with modifications to use HTTPConnection class by Chris Hoke
 and final touches by me, Arkadiusz Wahlig.
 """
 
-import sys
-import httplib
-import mimetypes
-from random import randrange
+import os
+import threading
+from time import time
+from binascii import hexlify
+from cStringIO import StringIO
 
+from scribd import forksafe
+from scribd import profiler
+from scribd import tasks
 
-def post_multipart(host, selector, fields=(), headers=None, port=None):
+
+# Number of bytes read from file objects and sent at once.
+BLOCK_SIZE = 64 * 1024
+
+# Content types of the document formats accepted by Scribd. Other types
+# are looked up using the mimetypes module, which loads the system MIME
+# database on first use.
+MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.ps': 'application/postscript',
+    '.rtf': 'application/rtf',
+    '.epub': 'application/epub+zip',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.pps': 'application/vnd.ms-powerpoint',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.ppsx': 'application/vnd.openxmlformats-officedocument.presentationml.slideshow',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.odt': 'application/vnd.oasis.opendocument.text',
+    '.odp': 'application/vnd.oasis.opendocument.presentation',
+    '.ods': 'application/vnd.oasis.opendocument.spreadsheet',
+    '.odg': 'application/vnd.oasis.opendocument.graphics',
+    '.odf': 'application/vnd.oasis.opendocument.formula',
+    '.sxw': 'application/vnd.sun.xml.writer',
+    '.sxc': 'application/vnd.sun.xml.calc',
+    '.sxi': 'application/vnd.sun.xml.impress',
+    '.sxd': 'application/vnd.sun.xml.draw',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+}
+
+
+class Response(object):
+    """A fully read HTTP response.
+    
+    Provides the subset of the httplib.HTTPResponse interface used by
+    the library. Because the body is read immediately, the connection
+    the response came from can be reused right away.
+    """
+
+    def __init__(self, resp):
+        self.status = resp.status
+        self.reason = resp.reason
+        self.msg = resp.msg
+        self.will_close = resp.will_close
+        self.body = resp.read()
+        self._fp = StringIO(self.body)
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+    def getheaders(self):
+        return self.msg.items()
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._fp.read()
+        return self._fp.read(amt)
+
+
+class ConnectionPool(object):
+    """Keeps idle HTTP connections so they can be reused by the
+    following requests to the same host and port.
+    
+    Can be shared by many threads. After a fork, the child process starts
+    with an empty pool so no connection is shared between processes.
+    """
+
+    def __init__(self, maxsize=10):
+        """Instantiates a new pool.
+        
+        Parameters:
+          maxsize
+            (optional) Maximal number of idle connections kept per
+            host and port. Connections returned to a full pool are
+            closed.
+        """
+        self.maxsize = maxsize
+        self._idle = {} # (host, port) -> list of idle connections
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The sockets are left to the parent process. Dropping the
+        # references closes only the child's descriptors.
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port=None):
+        """Returns an idle connection to the host/port or a new one
+        if there is none.
+        """
+        forksafe.check()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get((host, port))
+            if idle:
+                return idle.pop()
+        finally:
+            self._lock.release()
+        import httplib
+        return httplib.HTTPConnection(host, port)
+
+    def put(self, conn, host, port=None):
+        """Returns a connection obtained by get() to the pool."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault((host, port), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def clear(self):
+        """Closes all idle connections."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class ShapedFile(object):
+    """Wraps a file object sent as a part of the multipart body, limiting
+    the rate at which it's read and reporting the progress.
+
+    The file is read in blocks right before they are sent, so the rate of
+    reading is the rate of sending.
+    """
+
+    def __init__(self, file, limiter=None, progress=None, deadline=None):
+        """Instantiates a new wrapper.
+
+        Parameters:
+          file
+            The file object. Has to be seekable for the progress to be
+            reported.
+          limiter
+            (optional) A tasks.RateLimiter object the read bytes are taken
+            from. May be shared by many files to limit their total rate.
+          progress
+            (optional) A callable called after every block with the number
+            of bytes sent, the total number of bytes to send and the rate
+            in bytes per second since the sending started.
+          deadline
+            (optional) The time.time() by which the file has to be sent.
+            If the limiter can't give the bytes before it, read() raises
+            tasks.DeadlineExceeded. Defaults to the deadline of the current
+            thread at the time the wrapper is created.
+        """
+        self.file = file
+        self.limiter = limiter
+        self.progress = progress
+        if deadline is None:
+            deadline = tasks.current_deadline()
+        self.deadline = deadline
+        self.name = getattr(file, 'name', None)
+        self._sent = 0
+        self._total = None
+        self._time = None
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+        if whence == 0:
+            # The body is about to be sent (again).
+            self._sent = 0
+            self._time = None
+            if self._total is None:
+                self._total = _file_part(self.file)[2]
+
+    def read(self, size=-1):
+        if self._time is None:
+            self._time = time()
+        data = self.file.read(size)
+        if data:
+            if self.limiter is not None and \
+                    not self.limiter.acquire(len(data), deadline=self.deadline):
+                raise tasks.DeadlineExceeded('deadline exceeded')
+            self._sent += len(data)
+            if self.progress is not None:
+                elapsed = time() - self._time
+                rate = 0.0
+                if elapsed > 0:
+                    rate = self._sent / elapsed
+                self.progress(self._sent, max(self._total, self._sent), rate)
+        return data
+
+
+def post_multipart(host, selector, fields=(), headers=None, port=None, pool=None,
+                   connect_timeout=None, read_timeout=None):
     """Posts a multipart/form-data request to an HTTP host/port.
     
     Parameters:
@@ -27,36 +235,131 @@ def post_multipart(host, selector, fields=(), headers=None, port=None):
         POST fields. A sequence of (name, value) tuples where "name" is the
         field name and "value" may be either a string or a (data, name)
         tuple in which case the "data" will be sent as a file of name "name".
+        The "data" may be a string or a file-alike object; file objects
+        are streamed in blocks without loading them into memory.
       headers
         A mapping of additional HTTP headers.
       port
         TCP/IP port. Defaults to 80.
+      pool
+        (optional) A ConnectionPool object. If given, the connection is
+        taken from and returned to the pool.
+      connect_timeout
+        (optional) Number of seconds to wait for a new connection to be
+        opened.
+      read_timeout
+        (optional) Number of seconds every following socket operation
+        (sending a block or receiving the response) may take.
         
     Returns:
-        A httplib.HTTPResponse object.
+        A Response object. Its "request_bytes" attribute is set to the
+        size of the request body.
     """
+    call = profiler.current()
     boundary = '----------%s--%s----------' % \
-        (randrange(sys.maxint), randrange(sys.maxint))
+        (hexlify(os.urandom(8)), hexlify(os.urandom(8)))
     if headers is None:
         headers = {}
     headers['Content-Type'] = 'multipart/form-data; boundary=%s' % boundary
-    body = encode_multipart_formdata(fields, boundary)
-    h = httplib.HTTPConnection(host, port)
-    h.request('POST', selector, body, headers)
-    return h.getresponse()
+    parts, length = encode_multipart_parts(fields, boundary)
+    if call is not None:
+        call.mark('body')
+    if pool is not None:
+        h = pool.get(host, port)
+    else:
+        import httplib
+        h = httplib.HTTPConnection(host, port)
+    try:
+        if h.sock is None:
+            if connect_timeout is not None:
+                h.timeout = connect_timeout
+            h.connect()
+            _set_nodelay(h.sock)
+        if read_timeout is not None:
+            h.sock.settimeout(read_timeout)
+        if call is not None:
+            call.mark('connect')
+        h.putrequest('POST', selector)
+        for name, value in headers.items():
+            h.putheader(name, value)
+        h.putheader('Content-Length', str(length))
+        h.endheaders()
+        for block in iter_multipart_parts(parts):
+            h.send(block)
+        if call is not None:
+            call.mark('send')
+        r = h.getresponse()
+        if call is not None:
+            call.mark('wait')
+        resp = Response(r)
+        if call is not None:
+            call.mark('receive')
+        resp.request_bytes = length
+    except:
+        h.close()
+        raise
+    if pool is not None and not resp.will_close:
+        pool.put(h, host, port)
+    else:
+        h.close()
+    return resp
+
+
+def _set_nodelay(sock):
+    # The headers and the body are sent separately. Without TCP_NODELAY,
+    # the body waits for the server to acknowledge the headers, which it
+    # may delay by up to 200 ms.
+    import socket
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (AttributeError, socket.error):
+        pass
 
 
 def encode_multipart_formdata(fields, boundary):
+    """Returns the whole multipart/form-data body as a string.
+    
+    Refer to post_multipart() for the description of "fields".
+    """
+    parts, length = encode_multipart_parts(fields, boundary)
+    return ''.join(iter_multipart_parts(parts))
+
+
+def encode_multipart_parts(fields, boundary):
+    """Splits a multipart/form-data body into parts that can be sent
+    one after another.
+    
+    Refer to post_multipart() for the description of "fields".
+
+    Returns:
+        A (parts, length) tuple where "parts" is a list of strings and
+        (file, offset, size) tuples and "length" is the total number of
+        bytes of the body. Pass "parts" to iter_multipart_parts() to
+        get the body.
+    """
+    parts = []
     lines = []
+    length = 0
     for key, value in fields:
         lines.append('--' + boundary)
         if isinstance(value, tuple): # file
             data, name = value
-            ctype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            ctype = guess_type(name)
             lines.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (key, name))
             lines.append('Content-Type: %s' % ctype)
             lines.append('')
-            lines.append(data)
+            if not isinstance(data, str):
+                data = _file_part(data)
+            if isinstance(data, tuple):
+                # Flush the text collected so far and put the file
+                # in between the text parts.
+                text = '\r\n'.join(lines) + '\r\n'
+                parts.append(text)
+                parts.append(data)
+                length += len(text) + data[2]
+                lines = ['']
+            else:
+                lines.append(data)
         elif isinstance(value, str): # str
             lines.append('Content-Disposition: form-data; name="%s"' % key)
             lines.append('')
@@ -64,4 +367,52 @@ def encode_multipart_formdata(fields, boundary):
         else:
             raise TypeError('value must be a tuple or str, not %s' % type(value).__name__)
     lines.append('--' + boundary + '--')
-    return '\r\n'.join(lines)
+    text = '\r\n'.join(lines)
+    parts.append(text)
+    length += len(text)
+    return parts, length
+
+
+def iter_multipart_parts(parts, blocksize=BLOCK_SIZE):
+    """Returns a generator yielding the body described by parts returned
+    by encode_multipart_parts() in blocks of strings.
+    
+    Files are read starting from the position they were at when the parts
+    were created, so the body can be generated many times.
+    """
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+            continue
+        file, offset, size = part
+        file.seek(offset)
+        while size > 0:
+            data = file.read(min(size, blocksize))
+            if not data:
+                raise IOError('file shrunk while being sent')
+            size -= len(data)
+            yield data
+
+
+def guess_type(name):
+    """Returns the content type of a file based on its name."""
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        return MIME_TYPES[ext]
+    except KeyError:
+        import mimetypes
+        return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _file_part(file):
+    # Returns a (file, offset, size) tuple describing the data remaining
+    # in the file. If the file isn't seekable, its data is read and
+    # returned as a string.
+    try:
+        offset = file.tell()
+        file.seek(0, 2)
+        size = file.tell() - offset
+        file.seek(offset)
+    except (AttributeError, IOError, ValueError):
+        return file.read()
+    return (file, offset, size)
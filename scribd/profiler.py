@@ -0,0 +1,305 @@
+"""
+Measures where the time of the API calls goes.
+
+While profiling is active, every API call is split into phases and the
+time spent in each of them is recorded:
+
+  encode
+    Encoding and signing of the call arguments.
+  body
+    Building of the multipart/form-data request body.
+  connect
+    Opening of the connection (zero if a pooled one was reused).
+  send
+    Sending of the request.
+  wait
+    Waiting for the server to start responding.
+  receive
+    Reading of the response body.
+  parse
+    Parsing of the XML response.
+  build
+    Construction of the Document and User objects from the response
+    (listings and lookups only).
+
+Use a Profile object to collect the calls performed in a block of code:
+
+    from scribd import profiler
+
+    with profiler.Profile() as prof:
+        docs = user.all()
+    print prof.report()
+
+The calls performed by all threads while the block runs are collected,
+including the worker threads of upload_many() and similar functions.
+The breakdown of the last call of the current thread is also available
+from last_call().
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import sys
+import threading
+from time import time
+
+
+# Phases of an API call in the order they happen.
+PHASES = ('encode', 'body', 'connect', 'send', 'wait', 'receive', 'parse', 'build')
+
+# True if any Profile is running. Checked by the library before doing
+# any profiling work.
+active = False
+
+_profiles = [] # running Profile objects
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class CallProfile(object):
+    """Breakdown of a single API call."""
+
+    def __init__(self, method):
+        self.method = method
+        self.start = time()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.allocated = None # Bytes, if the memory is tracked.
+        self._last = self.start
+        self._memory = None
+        self._memory_start = 0
+
+    def mark(self, phase):
+        """Adds the time passed since the previous mark (or the start
+        of the call) to the phase.
+        """
+        now = time()
+        self.phases[phase] += now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        """Sum of the phase times in seconds."""
+        return sum(self.phases.values())
+
+    def __repr__(self):
+        return '<%s: %s %.1f ms (%s)>' % (self.__class__.__name__, self.method,
+            self.total * 1000.0, ', '.join('%s=%.1f' % (phase, self.phases[phase] * 1000.0)
+                                           for phase in PHASES if self.phases[phase]))
+
+
+class Profile(object):
+    """Collects the CallProfile objects of the API calls performed while
+    it's running. Can be used as a context manager or with the start()
+    and stop() methods.
+    """
+
+    def __init__(self, memory=False, top=10):
+        """Instantiates a new profile.
+
+        Parameters:
+          memory
+            (optional) If True, the memory use is reported. By default
+            only the peak resident set size of the process is reported,
+            read with the resource module. If the tracemalloc module is
+            available (the third-party pytracemalloc package, which
+            needs a patched Python 2.7), the memory allocations are
+            traced while the profile is running instead. The bytes
+            allocated by every call are then stored in the "allocated"
+            attribute of its CallProfile and the largest allocation
+            sites are reported by report().
+          top
+            (optional) Number of allocation sites to keep if the memory
+            is traced.
+        """
+        self._tracemalloc = None
+        if memory:
+            try:
+                import tracemalloc
+            except ImportError:
+                try:
+                    import resource
+                except ImportError:
+                    raise ImportError('memory tracking requires the tracemalloc '
+                                      'or resource module')
+                self._resource = resource
+            else:
+                self._tracemalloc = tracemalloc
+        self.memory = memory
+        self.top = top
+        self.calls = []
+        self.duration = None
+        self.memory_peak = None # Bytes, if the memory is tracked.
+        self.allocations = [] # tracemalloc.Statistic objects.
+        self._start = None
+        self._started_tracing = False
+
+    def start(self):
+        """Starts collecting the calls."""
+        global active
+        tracemalloc = self._tracemalloc
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._snapshot = tracemalloc.take_snapshot()
+        self._start = time()
+        _lock.acquire()
+        try:
+            _profiles.append(self)
+            active = True
+        finally:
+            _lock.release()
+
+    def stop(self):
+        """Stops collecting the calls."""
+        global active
+        _lock.acquire()
+        try:
+            _profiles.remove(self)
+            active = bool(_profiles)
+        finally:
+            _lock.release()
+        self.duration = time() - self._start
+        tracemalloc = self._tracemalloc
+        if tracemalloc is not None:
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            stats = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+            self.allocations = stats[:self.top]
+            self._snapshot = None
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        elif self.memory:
+            self.memory_peak = _peak_rss(self._resource)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def _add(self, call):
+        self.calls.append(call)
+
+    def phases(self):
+        """Returns a dictionary mapping the phases to the total number
+        of seconds spent in them by all calls.
+        """
+        totals = dict.fromkeys(PHASES, 0.0)
+        for call in list(self.calls):
+            for phase, seconds in call.phases.items():
+                totals[phase] += seconds
+        return totals
+
+    def methods(self):
+        """Returns a dictionary mapping the API method names to
+        dictionaries with "calls", "total" and "phases" keys.
+        """
+        methods = {}
+        for call in list(self.calls):
+            m = methods.get(call.method)
+            if m is None:
+                m = methods[call.method] = {'calls': 0, 'total': 0.0,
+                                            'phases': dict.fromkeys(PHASES, 0.0)}
+            m['calls'] += 1
+            for phase, seconds in call.phases.items():
+                m['phases'][phase] += seconds
+                m['total'] += seconds
+        return methods
+
+    def report(self):
+        """Returns a text table with the time spent in every phase per
+        API method.
+        """
+        header = '%-28s %6s' % ('method', 'calls') + \
+            ''.join(' %9s' % phase for phase in PHASES) + ' %9s' % 'total'
+        lines = [header, '-' * len(header)]
+        for method, m in sorted(self.methods().items()):
+            lines.append('%-28s %6d' % (method, m['calls']) +
+                         ''.join(' %9.1f' % (m['phases'][phase] * 1000.0) for phase in PHASES) +
+                         ' %9.1f' % (m['total'] * 1000.0))
+        lines.append('(times in milliseconds)')
+        if self.memory_peak is not None:
+            lines.append('')
+            if self._tracemalloc is None:
+                lines.append('peak resident set size of the process: %d KB' %
+                             (self.memory_peak // 1024))
+            else:
+                lines.append('peak traced memory: %d KB' % (self.memory_peak // 1024))
+            for stat in self.allocations:
+                lines.append('  %s' % stat)
+        return '\n'.join(lines)
+
+
+def begin(method):
+    """Starts profiling an API call in the current thread. Returns the
+    CallProfile object or None if profiling isn't active.
+    """
+    if not active:
+        return None
+    call = CallProfile(method)
+    for profile in list(_profiles):
+        if profile._tracemalloc is not None:
+            call._memory = profile._tracemalloc
+            call._memory_start = call._memory.get_traced_memory()[0]
+            break
+    _local.call = call
+    return call
+
+
+def finish(call):
+    """Hands a CallProfile started by begin() over to the running
+    profiles. The object construction can still be added to the call
+    by built().
+    """
+    _local.call = None
+    _local.last = call
+    if call._memory is not None:
+        call.allocated = call._memory.get_traced_memory()[0] - call._memory_start
+    _lock.acquire()
+    try:
+        for profile in _profiles:
+            profile._add(call)
+    finally:
+        _lock.release()
+
+
+def current():
+    """Returns the CallProfile of the API call being performed by the
+    current thread or None.
+    """
+    if not active:
+        return None
+    return getattr(_local, 'call', None)
+
+
+def built(response):
+    """Adds the time since the end of the API call that returned the
+    response to its "build" phase. Called after the objects are
+    constructed from the response.
+
+    Only the thread that performed the call does it and only once, so
+    the responses shared by coalesced calls are not counted twice.
+    """
+    if not active:
+        return
+    call = getattr(response, 'profile', None)
+    if call is not None and call is getattr(_local, 'last', None):
+        response.profile = None
+        call.mark('build')
+
+
+def last_call():
+    """Returns the CallProfile of the last API call performed by the
+    current thread while profiling was active or None.
+    """
+    return getattr(_local, 'last', None)
+
+
+def _peak_rss(resource):
+    # Returns the peak resident set size of the process in bytes.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        rss *= 1024 # Reported in kilobytes.
+    return rss
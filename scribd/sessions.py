@@ -0,0 +1,279 @@
+"""
+Caches the session keys of logged in Scribd users.
+
+Every call to scribd.login() performs a user.login API call. The
+SessionManager class remembers the resulting session keys, in memory
+and optionally on disk, and hands out shared [User] objects. The user
+is logged in again only if the HOST reports that the session expired
+or a different password is given. Only a salted PBKDF2 digest of the
+password is stored on disk; the files are readable by their owner only.
+
+Usage:
+
+    from scribd.sessions import SessionManager
+
+    sessions = SessionManager('/var/cache/scribd-sessions')
+    user = sessions.login(username, password)
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import os
+import hmac
+import threading
+from ast import literal_eval
+from binascii import hexlify
+from hashlib import sha1, pbkdf2_hmac
+
+import scribd
+from scribd import forksafe
+
+
+# Error codes reported by the HOST if the session key is no longer valid.
+EXPIRED_SESSION_ERRORS = (401,)
+
+# Number of PBKDF2 iterations of the password digests stored on disk.
+PBKDF2_ITERATIONS = 100000
+
+
+class SessionUser(scribd.User):
+    """A [User] managed by a SessionManager object. Logs the user in again
+    if the HOST reports that the session expired.
+    """
+
+    __slots__ = ('_manager', '_username')
+
+    def __init__(self, manager, username):
+        self._manager = manager
+        self._username = username
+        scribd.User.__init__(self)
+
+    def _send_request(self, method, **fields):
+        """Sends a request to the HOST and returns the XML response."""
+        session_key = getattr(self, 'session_key', None)
+        try:
+            return scribd.User._send_request(self, method, **fields)
+        except scribd.ResponseError, err:
+            if err.errno not in EXPIRED_SESSION_ERRORS:
+                raise
+            if not self._manager._relogin(self, session_key):
+                # Forgotten in the meantime, the password is unknown.
+                raise
+        return scribd.User._send_request(self, method, **fields)
+
+
+class SessionManager(object):
+    """Caches session keys of logged in users and shares the [User]
+    objects. Can be used by many threads.
+    """
+
+    def __init__(self, directory=None, encode=None, decode=None):
+        """Instantiates a new manager.
+
+        Parameters:
+          directory
+            (optional) Directory where the session keys are stored so
+            they can be used by other processes. If None, the keys are
+            kept in memory only.
+          encode
+            (optional) A callable taking a string and returning it
+            encoded (e.g. encrypted) before it's written to disk.
+          decode
+            (optional) The reverse of "encode".
+        """
+        self.directory = directory
+        self.encode = encode
+        self.decode = decode
+        self._users = {} # username -> SessionUser
+        self._passwords = {} # username -> password
+        self._user_locks = {} # username -> lock held while logging in
+        self._lock = threading.Lock() # guards the dictionaries
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # The cached users are kept, the locks might have been held
+        # by threads of the parent process.
+        self._lock = threading.Lock()
+        self._user_locks = {}
+
+    def login(self, username, password):
+        """Returns a logged in [User] object.
+
+        The user.login API call is performed only if there is no cached
+        session key for the user or the password doesn't match the one
+        the cached session was created with.
+
+        Parameters:
+          username
+            Name of the user.
+          password
+            The user's password.
+
+        Returns:
+            A [User] object shared by all callers asking for this user.
+        """
+        forksafe.check()
+        lock = self._user_lock(username)
+        # Only the logins of the same user wait for each other.
+        lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                user = self._users.get(username)
+                known = self._passwords.get(username)
+            finally:
+                self._lock.release()
+            if user is not None and known is not None and \
+                    hmac.compare_digest(_utf8(known), _utf8(password)):
+                return user
+            attrs = None
+            if user is None:
+                attrs = self._load(username, password)
+            if attrs is None:
+                attrs = self._login(username, password)
+            if user is None:
+                user = SessionUser(self, username)
+            user._attributes.update(attrs)
+            self._lock.acquire()
+            try:
+                self._users[username] = user
+                self._passwords[username] = password
+            finally:
+                self._lock.release()
+            return user
+        finally:
+            lock.release()
+
+    def forget(self, username):
+        """Removes the cached session of the user."""
+        self._lock.acquire()
+        try:
+            self._users.pop(username, None)
+            self._passwords.pop(username, None)
+            path = self._path(username)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        finally:
+            self._lock.release()
+
+    def _user_lock(self, username):
+        # Returns the lock serializing the logins of the user.
+        self._lock.acquire()
+        try:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.Lock()
+            return lock
+        finally:
+            self._lock.release()
+
+    def _relogin(self, user, session_key):
+        # Called by the SessionUser if its session expired. The user
+        # is logged in only if no other thread has done it already.
+        # Returns False if the user was forgotten.
+        lock = self._user_lock(user._username)
+        lock.acquire()
+        try:
+            if getattr(user, 'session_key', None) == session_key:
+                self._lock.acquire()
+                try:
+                    password = self._passwords.get(user._username)
+                finally:
+                    self._lock.release()
+                if password is None:
+                    return False
+                attrs = self._login(user._username, password)
+                user._attributes.update(attrs)
+            return True
+        finally:
+            lock.release()
+
+    def _login(self, username, password):
+        # Logs the user in, stores and returns the user's attributes.
+        attrs = scribd.login(username, password).get_attributes()
+        path = self._path(username)
+        if path is not None:
+            stored = attrs.copy()
+            stored[_DIGEST_KEY] = _password_digest(password)
+            data = repr(stored)
+            if self.encode is not None:
+                data = self.encode(data)
+            # Write to a temporary file first so other processes never
+            # read a partially written file. Only the owner may read it.
+            temp = '%s.%d.%d' % (path, os.getpid(), id(threading.currentThread()))
+            file = os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'wb')
+            try:
+                file.write(data)
+            finally:
+                file.close()
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+        return attrs
+
+    def _load(self, username, password):
+        # Returns the user's attributes stored on disk or None if there
+        # are none or they were stored for another password.
+        path = self._path(username)
+        if path is None or not os.path.exists(path):
+            return None
+        file = open(path, 'rb')
+        try:
+            data = file.read()
+        finally:
+            file.close()
+        try:
+            if self.decode is not None:
+                data = self.decode(data)
+            attrs = literal_eval(data)
+        except Exception:
+            # Unreadable file, the user will be logged in again.
+            return None
+        if not isinstance(attrs, dict) or 'session_key' not in attrs:
+            return None
+        if not _check_password(attrs.pop(_DIGEST_KEY, None), password):
+            return None
+        return attrs
+
+    def _path(self, username):
+        if self.directory is None:
+            return None
+        if isinstance(username, unicode):
+            username = username.encode('utf8')
+        return os.path.join(self.directory, sha1(username).hexdigest())
+
+
+# Key of the password digest in the stored attributes.
+_DIGEST_KEY = '_password_digest'
+
+
+def _password_digest(password):
+    # Returns a salted PBKDF2 digest of the password as
+    # a "pbkdf2_sha256$iterations$salt$digest" string.
+    salt = hexlify(os.urandom(16))
+    return 'pbkdf2_sha256$%d$%s$%s' % (PBKDF2_ITERATIONS, salt,
+                                       _hash(salt, password, PBKDF2_ITERATIONS))
+
+
+def _check_password(digest, password):
+    # Returns True if the password matches a digest returned by
+    # _password_digest().
+    try:
+        algorithm, iterations, salt, expected = digest.split('$')
+        iterations = int(iterations)
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != 'pbkdf2_sha256':
+        return False
+    return hmac.compare_digest(_hash(salt, password, iterations), expected)
+
+
+def _hash(salt, password, iterations):
+    return hexlify(pbkdf2_hmac('sha256', _utf8(password), salt, iterations))
+
+
+def _utf8(text):
+    if isinstance(text, unicode):
+        return text.encode('utf8')
+    return text
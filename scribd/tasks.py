@@ -0,0 +1,840 @@
+"""
+Runs library operations concurrently using a bounded pool of threads.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import sys
+import threading
+from time import time, sleep
+from Queue import Queue
+from collections import deque
+from contextlib import contextmanager
+
+from scribd import forksafe
+from scribd import metrics
+
+
+# Priority classes of the API calls, see priority() and Scheduler.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Markers put on the queues.
+_STOP = object()
+_DONE = object()
+
+_local = threading.local()
+
+
+def current_priority():
+    """Returns the priority class of the API calls made by the current
+    thread, INTERACTIVE unless set otherwise.
+    """
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+def set_priority(level):
+    """Sets the priority class of the API calls made by the current
+    thread. Returns the previous one.
+    """
+    if level not in (INTERACTIVE, BACKGROUND):
+        raise ValueError('unknown priority: %r' % (level,))
+    previous = current_priority()
+    _local.priority = level
+    return previous
+
+
+@contextmanager
+def priority(level):
+    """Returns a context manager setting the priority class of the API
+    calls made by the current thread inside the with-block:
+
+        with scribd.priority(scribd.BACKGROUND):
+            for doc in user.xall():
+                ...
+
+    Threads started by imap() (and so by upload_many() and other bulk
+    functions) inherit the priority of the thread calling it.
+    """
+    previous = set_priority(level)
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_deadline():
+    """Returns the time (as returned by time.time()) by which the API
+    calls made by the current thread have to finish or None.
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def set_deadline(end):
+    """Sets the time by which the API calls made by the current thread
+    have to finish (None for no limit). Returns the previous one.
+    """
+    previous = current_deadline()
+    _local.deadline = end
+    return previous
+
+
+@contextmanager
+def deadline(timeout):
+    """Returns a context manager limiting the time of all API calls
+    made by the current thread inside the with-block, including their
+    retries, to "timeout" seconds in total:
+
+        with scribd.deadline(2.0):
+            docs = user.find('report')
+
+    Calls made after the time runs out raise scribd.TimeoutError. Nested
+    blocks can only shorten the limit. Like the priority, the deadline
+    is inherited by the threads started by imap().
+    """
+    previous = current_deadline()
+    end = time() + timeout
+    if previous is not None and previous < end:
+        end = previous
+    _local.deadline = end
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def imap(function, iterable, concurrency=4, ordered=False):
+    """Calls the function for every item of the iterable using a pool of
+    threads and returns a generator object yielding the results.
+
+    Parameters:
+      function
+        A callable taking a single item.
+      iterable
+        The items. Consumed lazily, only a few items more than the
+        number of threads are taken ahead.
+      concurrency
+        (optional) Number of threads calling the function.
+      ordered
+        (optional) If True, the results are yielded in the order of the
+        items. Otherwise they are yielded as soon as they are ready.
+
+    Returns:
+        A generator object yielding (item, result, error) tuples. If the
+        function raised an exception, "result" is None and "error" is
+        the exception object. Otherwise "error" is None.
+
+    Exceptions raised while iterating the iterable are reraised by the
+    generator. If the generator is closed before all results are consumed,
+    no new items are started.
+
+    The threads inherit the priority and deadline of the calling thread.
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    return _imap(function, iterable, concurrency, ordered, _local.__dict__.copy())
+
+
+def _imap(function, iterable, concurrency, ordered, context):
+    items = Queue(concurrency * 2)
+    results = Queue()
+    stopped = threading.Event()
+    failure = []
+
+    def feed():
+        _local.__dict__.update(context)
+        try:
+            try:
+                for index, item in enumerate(iterable):
+                    if stopped.isSet():
+                        break
+                    items.put((index, item))
+            except:
+                failure.append(sys.exc_info())
+        finally:
+            for i in xrange(concurrency):
+                items.put(_STOP)
+
+    def work():
+        _local.__dict__.update(context)
+        try:
+            while True:
+                task = items.get()
+                if task is _STOP:
+                    break
+                index, item = task
+                if stopped.isSet():
+                    continue
+                try:
+                    result = (item, function(item), None)
+                except Exception, err:
+                    result = (item, None, err)
+                results.put((index, result))
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend(threading.Thread(target=work) for i in xrange(concurrency))
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+
+    try:
+        running = concurrency
+        waiting = {} # index -> result, used if ordered
+        next_index = 0
+        while running:
+            entry = results.get()
+            if entry is _DONE:
+                running -= 1
+                continue
+            index, result = entry
+            if not ordered:
+                yield result
+                continue
+            waiting[index] = result
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+        if failure:
+            exc_type, exc_value, exc_tb = failure[0]
+            raise exc_type, exc_value, exc_tb
+    finally:
+        stopped.set()
+
+
+class Budget(object):
+    """Limits the total size of the items processed at once.
+    
+    Can be shared by many threads.
+    """
+
+    def __init__(self, limit):
+        """Instantiates a new budget.
+        
+        Parameters:
+          limit
+            Maximal total size of the items acquired at once. A single
+            item larger than the limit is allowed if nothing else is
+            acquired at that time.
+        """
+        self.limit = limit
+        self.used = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """Blocks until "size" fits in the budget and takes it. Doesn't
+        block if the budget is closed.
+        """
+        self._cond.acquire()
+        try:
+            while not self.closed and self.used and self.used + size > self.limit:
+                self._cond.wait()
+            self.used += size
+        finally:
+            self._cond.release()
+
+    def release(self, size):
+        """Returns "size" taken by acquire() to the budget."""
+        self._cond.acquire()
+        try:
+            self.used -= size
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def close(self):
+        """Stops limiting, releasing all threads waiting in acquire().
+        Used when the work is abandoned and the taken sizes may never
+        be returned.
+        """
+        self._cond.acquire()
+        try:
+            self.closed = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+
+class RateLimiter(object):
+    """Limits the rate at which many threads use a resource, for example
+    the number of bytes sent per second.
+
+    Implements a token bucket: "rate" tokens are added every second up to
+    "burst" tokens. Taking more tokens than available blocks the thread
+    until the missing ones are added.
+
+    Can be shared by many threads.
+    """
+
+    def __init__(self, rate, burst=None):
+        """Instantiates a new limiter.
+
+        Parameters:
+          rate
+            Number of tokens (for example bytes or calls) allowed per
+            second.
+          burst
+            (optional) Maximal number of tokens that can be taken at
+            once without waiting. Defaults to one second worth of tokens.
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        if burst is None:
+            burst = rate
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time()
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1, deadline=None):
+        """Takes "amount" tokens, blocking until they are available.
+
+        Threads take the tokens in the order they ask for them. An amount
+        larger than "burst" is allowed; it makes the following threads
+        wait longer.
+
+        Returns True. If "deadline" (a time.time() value) is given and
+        the tokens wouldn't be available by then, returns False at once
+        without taking them.
+        """
+        forksafe.check()
+        self._lock.acquire()
+        try:
+            now = time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            delay = (amount - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            self._tokens -= amount
+        finally:
+            self._lock.release()
+        if delay > 0:
+            sleep(delay)
+        return True
+
+
+class Scheduler(object):
+    """Grants connection slots and rate tokens to the API requests of many
+    threads in the order of their priority classes.
+
+    A request waits until fewer than "slots" requests are in progress and,
+    if "rate" is given, until the rate allows it. INTERACTIVE requests
+    are served before the BACKGROUND ones, except that while both wait,
+    "background_share" of the grants go to the BACKGROUND requests so
+    they aren't starved. Requests of the same class are served in the
+    order they came.
+
+    Can be shared by many threads.
+    """
+
+    def __init__(self, slots=10, rate=None, burst=None, background_share=0.1):
+        """Instantiates a new scheduler.
+
+        Parameters:
+          slots
+            (optional) Maximal number of requests in progress at once.
+            Should not exceed the size of the connection pool so every
+            request gets an idle connection.
+          rate
+            (optional) Maximal number of requests started per second.
+            Unlimited if None.
+          burst
+            (optional) Number of requests that can be started at once
+            after a pause. Defaults to one second worth of requests.
+          background_share
+            (optional) Fraction (0.0 to 1.0) of the grants given to the
+            BACKGROUND requests while requests of both classes wait.
+        """
+        if slots < 1:
+            raise ValueError('slots must be at least 1')
+        if rate is not None and rate <= 0:
+            raise ValueError('rate must be positive')
+        if not 0.0 <= background_share <= 1.0:
+            raise ValueError('background_share must be between 0.0 and 1.0')
+        self.slots = slots
+        self.rate = rate
+        if burst is None and rate is not None:
+            burst = max(rate, 1)
+        self.burst = burst
+        self.background_share = background_share
+        self.in_use = 0
+        self._queues = (deque(), deque()) # waiting threads by priority
+        self._credit = 0.0 # grants owed to BACKGROUND requests
+        self._tokens = burst
+        self._last = time()
+        self._cond = threading.Condition()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # Requests in progress belong to the threads of the parent process.
+        self.in_use = 0
+        self._queues = (deque(), deque())
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=None, deadline=None):
+        """Blocks until the request may be sent. Must be followed by
+        a call to release() once the request is finished.
+
+        Parameters:
+          priority
+            (optional) INTERACTIVE or BACKGROUND. Defaults to the priority
+            of the current thread, see priority().
+          deadline
+            (optional) Time (as returned by time.time()) after which to
+            give up waiting.
+
+        Returns:
+            True if the request may be sent, False if the deadline passed.
+        """
+        if priority is None:
+            priority = current_priority()
+        elif priority not in (INTERACTIVE, BACKGROUND):
+            raise ValueError('unknown priority: %r' % (priority,))
+        forksafe.check()
+        entry = object()
+        self._cond.acquire()
+        try:
+            queue = self._queues[priority]
+            queue.append(entry)
+            try:
+                while True:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time()
+                        if remaining <= 0:
+                            queue.remove(entry)
+                            self._cond.notifyAll()
+                            return False
+                    if self.in_use < self.slots and self._head() is entry:
+                        delay = self._take_token()
+                        if delay <= 0:
+                            break
+                        # The head keeps its place while waiting for the
+                        # token unless a more urgent request comes.
+                        self._cond.release()
+                        try:
+                            sleep(min(delay, remaining or delay))
+                        finally:
+                            self._cond.acquire()
+                    else:
+                        self._cond.wait(remaining)
+            except:
+                queue.remove(entry)
+                self._cond.notifyAll()
+                raise
+            if self._queues[1 - priority]:
+                # Both classes are waiting.
+                self._credit = min(self._credit + self.background_share, 1.0)
+                if priority == BACKGROUND:
+                    self._credit -= 1.0
+            queue.popleft()
+            self.in_use += 1
+            # There is a new head.
+            self._cond.notifyAll()
+            return True
+        finally:
+            self._cond.release()
+
+    def release(self):
+        """Frees the slot taken by acquire()."""
+        self._cond.acquire()
+        try:
+            self.in_use -= 1
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _head(self):
+        # Returns the entry of the thread to be served next.
+        interactive, background = self._queues
+        if not background:
+            if interactive:
+                return interactive[0]
+            return None
+        if not interactive or self._credit + self.background_share >= 1.0:
+            return background[0]
+        return interactive[0]
+
+    def _take_token(self):
+        # Takes a rate token. Returns 0 if it was taken or the number of
+        # seconds until it's available.
+        if self.rate is None:
+            return 0
+        now = time()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / float(self.rate)
+
+
+class Hedger(object):
+    """Hedges slow idempotent calls to cut the tail latency.
+
+    If a call doesn't return within the given percentile of the recent
+    latencies of the calls with the same key, an identical call is started
+    in another thread. The result of the one finishing first is used and
+    the other one is cancelled. The number of the extra calls is limited
+    to a fraction of all calls.
+
+    A thread is started for every call that may be hedged, so hedging
+    pays off only for calls taking milliseconds or more, like the API
+    calls.
+
+    Can be shared by many threads.
+    """
+
+    def __init__(self, percentile=95.0, max_extra=0.05, samples=100, min_samples=20,
+                 min_delay=0.001):
+        """Instantiates a new hedger.
+
+        Parameters:
+          percentile
+            (optional) Percentile of the recent latencies after which
+            a call is hedged.
+          max_extra
+            (optional) Maximal number of extra calls as a fraction of all
+            calls. Unused extra calls are saved for bursts of slow calls,
+            up to 10 of them.
+          samples
+            (optional) Number of recent latencies kept per key.
+          min_samples
+            (optional) Number of latencies needed before calls with the
+            key are hedged.
+          min_delay
+            (optional) Minimal number of seconds before a call is hedged.
+        """
+        if not 0.0 < percentile < 100.0:
+            raise ValueError('percentile must be between 0 and 100')
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.samples = samples
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.calls = 0 # calls that could be hedged
+        self.hedged = 0 # extra calls started
+        self.wins = 0 # extra calls that finished first
+        self._latencies = {} # key -> deque of seconds
+        self._budget = 1.0 # extra calls that may be started now
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def delay(self, key):
+        """Returns the number of seconds after which a call with the key
+        is hedged or None if there are too few latencies known.
+        """
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            latencies = sorted(latencies)
+        finally:
+            self._lock.release()
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+        return max(latencies[index], self.min_delay)
+
+    def observe(self, key, seconds):
+        """Adds the latency of a call with the key."""
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.samples)
+            latencies.append(seconds)
+        finally:
+            self._lock.release()
+
+    def call(self, key, function, admit=None):
+        """Calls function(attempt) and returns its result. If the call is
+        slow, calls function(attempt) again in another thread and returns
+        the result of the one finishing first.
+
+        The "attempt" is an Attempt object. The function should register
+        a callable aborting the call (for example closing its socket) with
+        attempt.on_cancel(). The call that finishes second is aborted and
+        its result or exception is ignored. If the first call fails while
+        the extra one is running, the extra one is waited for.
+
+        "admit" is an optional callable called by the hedging thread
+        before the extra call, so it can take its share of the limited
+        resources. It returns a callable releasing them afterwards or
+        None if the extra call may not be made.
+
+        The latencies observed are those of the first calls, even if the
+        extra ones win.
+        """
+        start = time()
+        self._lock.acquire()
+        try:
+            self.calls += 1
+            self._budget = min(self._budget + self.max_extra, 10.0)
+        finally:
+            self._lock.release()
+        delay = self.delay(key)
+        if delay is None:
+            result = function(Attempt())
+            self.observe(key, time() - start)
+            return result
+
+        race = _Race()
+        hedge = threading.Thread(target=self._hedge, args=(race, delay, function, admit))
+        hedge.setDaemon(True)
+        hedge.start()
+        try:
+            result = function(race.attempts[0])
+        except:
+            error = sys.exc_info()
+            elapsed = time() - start
+            if not race.wait_for_extra():
+                # Failed on its own and the hedge hasn't started.
+                raise error[0], error[1], error[2]
+            # Cancelled because the hedge finished first or failed while
+            # the hedge is running.
+            race.done.wait()
+            if race.winner != 1:
+                raise error[0], error[1], error[2]
+            result = race.result
+        else:
+            elapsed = time() - start
+            if race.claim(0):
+                race.attempts[1].cancel()
+        self.observe(key, elapsed)
+        return result
+
+    def _hedge(self, race, delay, function, admit):
+        # Runs in a separate thread; starts the extra call if the first
+        # one hasn't finished after "delay" seconds.
+        sleep(delay)
+        if race.finished():
+            return
+        self._lock.acquire()
+        try:
+            taken = self._budget >= 1.0
+            if taken:
+                self._budget -= 1.0
+        finally:
+            self._lock.release()
+        allowed = taken
+        release = None
+        if allowed and admit is not None:
+            release = admit()
+            allowed = release is not None
+        if not allowed or not race.start_extra():
+            if taken:
+                # Not used after all.
+                self._lock.acquire()
+                try:
+                    self._budget += 1.0
+                finally:
+                    self._lock.release()
+            if release is not None:
+                release()
+            if not allowed:
+                metrics.count('hedges_skipped_total')
+            return
+        self._lock.acquire()
+        try:
+            self.hedged += 1
+        finally:
+            self._lock.release()
+        metrics.count('hedged_calls_total')
+        try:
+            try:
+                result = function(race.attempts[1])
+            finally:
+                if release is not None:
+                    release()
+        except Exception:
+            race.done.set()
+            return
+        if race.claim(1):
+            race.result = result
+            self._lock.acquire()
+            try:
+                self.wins += 1
+            finally:
+                self._lock.release()
+            metrics.count('hedge_wins_total')
+            race.done.set()
+            race.attempts[0].cancel()
+        else:
+            race.done.set()
+
+
+class Attempt(object):
+    """One of the calls made by Hedger.call()."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback):
+        """Registers a callable aborting the call. It's called right away
+        if the attempt is already cancelled.
+        """
+        self._lock.acquire()
+        try:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback()
+
+    def cancel(self):
+        """Aborts the call by calling the registered callables."""
+        self._lock.acquire()
+        try:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            callback()
+
+
+class _Race(object):
+    # State shared by the attempts of a hedged call.
+
+    def __init__(self):
+        self.attempts = (Attempt(), Attempt())
+        self.winner = None # index of the attempt that finished first
+        self.result = None # of the extra call, if it won
+        self.started = False # True if the extra call was started
+        self.done = threading.Event() # set when the extra call finished
+        self._lock = threading.Lock()
+
+    def start_extra(self):
+        # Returns True if the extra call may start, the first one hasn't
+        # finished or failed yet.
+        self._lock.acquire()
+        try:
+            if self.winner is not None:
+                return False
+            self.started = True
+            return True
+        finally:
+            self._lock.release()
+
+    def wait_for_extra(self):
+        # Called if the first call failed. Returns True if the extra call
+        # was started and has to be waited for. Otherwise it's never
+        # started.
+        self._lock.acquire()
+        try:
+            if self.started:
+                return True
+            self.winner = 0
+            return False
+        finally:
+            self._lock.release()
+
+    def claim(self, index):
+        # Returns True if the attempt finished first.
+        self._lock.acquire()
+        try:
+            if self.winner is None:
+                self.winner = index
+            return self.winner == index
+        finally:
+            self._lock.release()
+
+    def finished(self):
+        return self.winner is not None
+
+
+class Cancelled(Exception):
+    """Exception raised by a call whose Attempt was cancelled before
+    the call was made.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """Exception raised by SingleFlight.do() if the deadline of the
+    current thread passes while it waits for the call in progress.
+    """
+
+
+class SingleFlight(object):
+    """Lets concurrent calls with the same key share a single execution.
+
+    While a call is in progress, other threads calling do() with the same
+    key wait for it and receive its result (or its exception) instead of
+    calling the function themselves.
+
+    Can be shared by many threads.
+    """
+
+    def __init__(self):
+        self._flights = {} # key -> _Flight
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        # Calls in progress belong to the threads of the parent process.
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """Calls function(*args) or waits for the call in progress with
+        the same key. Returns the result of the call. If the call raised
+        an exception, it is raised in all waiting threads too. The key
+        must be hashable.
+
+        A waiting thread raises DeadlineExceeded if its deadline (see
+        deadline()) passes first.
+        """
+        forksafe.check()
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        finally:
+            self._lock.release()
+        if not leader:
+            end = current_deadline()
+            if end is None:
+                flight.done.wait()
+            elif not flight.done.wait(max(end - time(), 0)):
+                raise DeadlineExceeded('deadline exceeded')
+            if flight.error is not None:
+                raise flight.error[0], flight.error[1], flight.error[2]
+            return flight.result
+        try:
+            try:
+                flight.result = function(*args)
+            except:
+                flight.error = sys.exc_info()
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+            finally:
+                self._lock.release()
+            flight.done.set()
+        return flight.result
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None # sys.exc_info() tuple
@@ -0,0 +1,240 @@
+"""
+In-process full-text index of the documents of user accounts.
+
+Searching the own documents of a user by title, description or tags
+doesn't need a docs.search call if the catalog of the user is indexed
+locally:
+
+    import scribd
+    from scribd.textindex import TextIndex
+
+    scribd.text_index = TextIndex()
+    scribd.text_index.build(user)
+
+    docs = user.find('annual rep*', local=True)
+
+The index is built from the [User].xall() results and kept current by
+[Document].save(), [User].upload() and [Document].delete() performed by
+this process. Changes made elsewhere are picked up by building the index
+of the user again.
+
+Queries are sequences of words, all of which must appear in the title,
+description or tags of a document (AND). A word ending with "*" matches
+all words starting with it. Matching is case-insensitive.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import re
+import threading
+from bisect import bisect_left, insort
+
+from scribd import forksafe
+
+
+# Resource attributes whose text is indexed.
+FIELDS = ('title', 'description', 'tags')
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+_query_re = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+
+class TextIndex(object):
+    """Indexes the documents of users. Can be used by many threads."""
+
+    def __init__(self):
+        self._catalogs = {} # owner key -> _Catalog
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def build(self, user, **kwargs):
+        """Indexes all documents of the user, replacing the previous index
+        of the user.
+
+        Parameters:
+          user
+            A [User] object.
+          keyword arguments
+            Passed to [User].xall().
+
+        Returns:
+            The number of indexed documents.
+        """
+        catalog = _Catalog()
+        for doc in user.xall(**kwargs):
+            catalog.add(doc.doc_id, doc.get_attributes())
+        self._lock.acquire()
+        try:
+            self._catalogs[user._get_owner_key()] = catalog
+        finally:
+            self._lock.release()
+        return len(catalog.docs)
+
+    def forget(self, user):
+        """Drops the index of the user."""
+        self._lock.acquire()
+        try:
+            self._catalogs.pop(user._get_owner_key(), None)
+        finally:
+            self._lock.release()
+
+    def is_built(self, user):
+        """Returns True if the documents of the user are indexed."""
+        return user._get_owner_key() in self._catalogs
+
+    def add(self, doc, defaults=None):
+        """Adds a document to the index of its owner or updates it with
+        the current resource attributes. Does nothing if the documents of
+        the owner aren't indexed.
+
+        Parameters:
+          doc
+            A [Document] object.
+          defaults
+            (optional) A dictionary of attributes used if neither the
+            document nor its indexed version has them.
+        """
+        attrs = doc.get_attributes()
+        self._lock.acquire()
+        try:
+            catalog = self._catalogs.get(doc.owner._get_owner_key())
+            if catalog is not None:
+                catalog.add(doc.doc_id, attrs, defaults)
+        finally:
+            self._lock.release()
+
+    def remove(self, doc):
+        """Removes a document from the index of its owner."""
+        self._lock.acquire()
+        try:
+            catalog = self._catalogs.get(doc.owner._get_owner_key())
+            if catalog is not None:
+                catalog.remove(doc.doc_id)
+        finally:
+            self._lock.release()
+
+    def search(self, user, query, offset=0, limit=None):
+        """Searches the documents of the user.
+
+        Parameters:
+          user
+            A [User] object.
+          query
+            The query. Refer to the module documentation.
+          offset
+            (optional) Number of matching documents to skip.
+          limit
+            (optional) Maximal number of documents to return.
+
+        Returns:
+            A list of resource attribute dictionaries of the matching
+            documents in the order they were indexed, or None if the
+            documents of the user aren't indexed.
+        """
+        terms = _query_re.findall(_text(query).lower())
+        self._lock.acquire()
+        try:
+            catalog = self._catalogs.get(user._get_owner_key())
+            if catalog is None:
+                return None
+            doc_ids = catalog.search(terms)
+            if limit is None:
+                doc_ids = doc_ids[offset:]
+            else:
+                doc_ids = doc_ids[offset:offset + limit]
+            return [catalog.docs[doc_id].copy() for doc_id in doc_ids]
+        finally:
+            self._lock.release()
+
+
+class _Catalog(object):
+    # The index of the documents of a single user.
+
+    def __init__(self):
+        self.docs = {} # doc_id -> resource attributes
+        self.order = {} # doc_id -> sequence number
+        self.words = {} # doc_id -> set of words
+        self.postings = {} # word -> set of doc_ids
+        self.sorted_words = [] # for the prefix lookups
+        self.count = 0
+
+    def add(self, doc_id, attrs, defaults=None):
+        old = self.docs.get(doc_id)
+        if old is not None:
+            old = old.copy()
+            old.update(attrs)
+            attrs = old
+        else:
+            self.order[doc_id] = self.count
+            self.count += 1
+        if defaults:
+            # Applied after the merge so they never replace known values.
+            attrs = attrs.copy()
+            for name, value in defaults.items():
+                attrs.setdefault(name, value)
+        self.docs[doc_id] = attrs
+        words = set()
+        for name in FIELDS:
+            value = attrs.get(name)
+            if value:
+                words.update(_word_re.findall(_text(value).lower()))
+        previous = self.words.get(doc_id, set())
+        for word in previous - words:
+            self._unpost(word, doc_id)
+        for word in words - previous:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = set()
+                insort(self.sorted_words, word)
+            posting.add(doc_id)
+        self.words[doc_id] = words
+
+    def remove(self, doc_id):
+        if self.docs.pop(doc_id, None) is None:
+            return
+        del self.order[doc_id]
+        for word in self.words.pop(doc_id):
+            self._unpost(word, doc_id)
+
+    def _unpost(self, word, doc_id):
+        posting = self.postings[word]
+        posting.discard(doc_id)
+        if not posting:
+            del self.postings[word]
+            del self.sorted_words[bisect_left(self.sorted_words, word)]
+
+    def search(self, terms):
+        # Returns the doc_ids matching all (word, star) terms.
+        if not terms:
+            return []
+        sets = []
+        for word, star in terms:
+            if star:
+                matches = set()
+                i = bisect_left(self.sorted_words, word)
+                while i < len(self.sorted_words) and self.sorted_words[i].startswith(word):
+                    matches.update(self.postings[self.sorted_words[i]])
+                    i += 1
+            else:
+                matches = self.postings.get(word, ())
+            if not matches:
+                return []
+            sets.append(matches)
+        sets.sort(key=len)
+        result = set(sets[0])
+        for matches in sets[1:]:
+            result.intersection_update(matches)
+        return sorted(result, key=self.order.get)
+
+
+def _text(value):
+    # Returns the value as a unicode string.
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return unicode(value)
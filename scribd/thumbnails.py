@@ -0,0 +1,276 @@
+"""
+On-disk cache of document thumbnails.
+
+Thumbnails are downloaded once and served from local files afterwards:
+
+    import scribd
+
+    for doc, path, error in scribd.fetch_thumbnails(docs, '/var/cache/thumbs'):
+        ...
+
+The files are stored under the cache directory by the digest of their
+data, so a thumbnail shared by many URLs is stored once. An SQLite
+database in the same directory maps the URLs to the files and keeps
+the validators (ETag and Last-Modified) and access times. If the total
+size of the files exceeds the limit, the least recently used ones are
+removed.
+
+A cached thumbnail younger than "max_age" seconds is used without any
+request. An older one is revalidated with a conditional request and
+downloaded again only if it has changed.
+
+Distributed under the new BSD License, see the
+accompanying LICENSE file for more information.
+"""
+
+import os
+import socket
+import sqlite3
+import httplib
+import urlparse
+from time import time
+from hashlib import sha1
+
+from scribd import metrics
+from scribd.download import DownloadError, MAX_REDIRECTS
+from scribd.multipart import ConnectionPool
+
+
+# Name of the index database in the cache directory.
+INDEX_NAME = 'index.db'
+
+
+class ThumbnailCache(object):
+    """A directory of cached thumbnails. Can be used by many threads and
+    processes at once.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, max_age=24 * 3600,
+                 timeout=30.0, pool=None):
+        """Opens the cache, creating the directory if needed.
+
+        Parameters:
+          path
+            Path of the cache directory.
+          max_bytes
+            (optional) Maximal total size of the cached files. The least
+            recently used files are removed above it.
+          max_age
+            (optional) Number of seconds a thumbnail is used without
+            revalidation.
+          timeout
+            (optional) Socket timeout of the requests in seconds.
+          pool
+            (optional) A ConnectionPool object the connections are taken
+            from. By default, every cache has its own pool.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        if pool is None:
+            pool = ConnectionPool()
+        self.pool = pool
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        db = self._connect()
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS thumbnails ('
+                       'url TEXT PRIMARY KEY, name TEXT, size INTEGER, '
+                       'etag TEXT, last_modified TEXT, checked REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS thumbnails_accessed '
+                       'ON thumbnails (accessed)')
+            db.commit()
+        finally:
+            db.close()
+
+    def _connect(self):
+        # A new connection is used for every operation, see DedupIndex.
+        return sqlite3.connect(os.path.join(self.path, INDEX_NAME), 30.0)
+
+    def get(self, url):
+        """Returns the path of the cached thumbnail, downloading or
+        revalidating it first if needed.
+        """
+        now = time()
+        db = self._connect()
+        try:
+            row = db.execute('SELECT name, etag, last_modified, checked FROM thumbnails '
+                             'WHERE url=?', (url,)).fetchone()
+            if row is not None and os.path.exists(self._file(row[0])):
+                name, etag, last_modified, checked = row
+                if now - checked < self.max_age:
+                    db.execute('UPDATE thumbnails SET accessed=? WHERE url=?', (now, url))
+                    db.commit()
+                    metrics.cache('thumbnails', True)
+                    return self._file(name)
+            else:
+                row = name = etag = last_modified = None
+        finally:
+            db.close()
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        status, resp_headers, data = self._request(url, headers)
+        if status == 304 and row is not None:
+            metrics.cache('thumbnails', True)
+            db = self._connect()
+            try:
+                db.execute('UPDATE thumbnails SET checked=?, accessed=? WHERE url=?',
+                           (now, now, url))
+                db.commit()
+            finally:
+                db.close()
+            return self._file(name)
+        if status != 200:
+            raise DownloadError('HTTP error %d: %s' % (status, url))
+        metrics.cache('thumbnails', False)
+
+        name = sha1(data).hexdigest() + _extension(url)
+        path = self._file(name)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            # Written under a temporary name so other threads and processes
+            # never see a partial file.
+            temp = '%s.%d.%d.tmp' % (path, os.getpid(), id(data))
+            file = open(temp, 'wb')
+            try:
+                file.write(data)
+            finally:
+                file.close()
+            os.rename(temp, path)
+        db = self._connect()
+        try:
+            db.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (url, name, len(data), resp_headers.get('etag'),
+                        resp_headers.get('last-modified'), now, now))
+            db.commit()
+            self._evict(db, name)
+        finally:
+            db.close()
+        return path
+
+    def size(self):
+        """Returns the total number of bytes of the cached files."""
+        db = self._connect()
+        try:
+            return self._size(db)
+        finally:
+            db.close()
+
+    def clear(self):
+        """Removes all cached thumbnails."""
+        db = self._connect()
+        try:
+            names = [row[0] for row in db.execute('SELECT DISTINCT name FROM thumbnails')]
+            db.execute('DELETE FROM thumbnails')
+            db.commit()
+        finally:
+            db.close()
+        for name in names:
+            self._remove(name)
+
+    def _file(self, name):
+        # Returns the path of a cached file. The files are spread over
+        # subdirectories named by the first two digits of the digest.
+        return os.path.join(self.path, name[:2], name)
+
+    def _size(self, db):
+        # Files shared by many URLs are counted once.
+        row = db.execute('SELECT SUM(size) FROM (SELECT DISTINCT name, size '
+                         'FROM thumbnails)').fetchone()
+        return row[0] or 0
+
+    def _evict(self, db, keep):
+        # Removes the least recently used thumbnails other than "keep"
+        # until the total size fits the limit.
+        total = self._size(db)
+        if total <= self.max_bytes:
+            return
+        removed = []
+        for url, name, size in db.execute('SELECT url, name, size FROM thumbnails '
+                                          'WHERE name != ? ORDER BY accessed',
+                                          (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute('DELETE FROM thumbnails WHERE url=?', (url,))
+            if db.execute('SELECT 1 FROM thumbnails WHERE name=?', (name,)).fetchone() is None:
+                removed.append(name)
+                total -= size
+        db.commit()
+        for name in removed:
+            self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(self._file(name))
+        except OSError:
+            pass
+
+    def _request(self, url, headers):
+        # Performs a GET request following the redirects. Returns
+        # a (status, headers, data) tuple, the header names are lowercase.
+        for i in xrange(MAX_REDIRECTS + 1):
+            scheme, netloc, path, params, query, fragment = urlparse.urlparse(url)
+            if scheme not in ('http', 'https'):
+                raise DownloadError('unsupported URL: %s' % url)
+            selector = urlparse.urlunparse(('', '', path or '/', params, query, ''))
+            resp = self._get(scheme, netloc, selector, headers)
+            location = resp.getheader('Location')
+            if resp.status in (301, 302, 303, 307) and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            return resp.status, dict(resp.getheaders()), resp.read()
+        raise DownloadError('too many redirects: %s' % url)
+
+    def _get(self, scheme, netloc, selector, headers):
+        # Performs a single GET request over a pooled connection. A request
+        # failed on a reused connection (which the server may have closed
+        # in the meantime) is repeated once on a new one.
+        from scribd.multipart import Response
+        if scheme == 'https':
+            h = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+            reused = False
+        else:
+            h = self.pool.get(netloc)
+            reused = h.sock is not None
+            h.timeout = self.timeout
+            if reused:
+                h.sock.settimeout(self.timeout)
+        while True:
+            try:
+                h.request('GET', selector, headers=headers)
+                resp = Response(h.getresponse())
+            except (httplib.HTTPException, socket.error):
+                h.close()
+                if not reused:
+                    raise
+                reused = False
+                continue
+            except:
+                h.close()
+                raise
+            break
+        if scheme == 'http' and not resp.will_close:
+            self.pool.put(h, netloc)
+        else:
+            h.close()
+        return resp
+
+
+def _extension(url):
+    # Returns the extension of the URL path, used as the extension of
+    # the cached file so it's served with the right content type.
+    ext = os.path.splitext(urlparse.urlparse(url)[2])[1].lower()
+    if len(ext) > 5 or not ext[1:].isalnum():
+        return ''
+    return ext
@@ -10,8 +10,6 @@ Distributed under the new BSD License, see the
 accompanying LICENSE file for more information.
 """
 
-from xml.dom import minidom
-
 
 class Element(object):
     """Encapsulates a single minidom element. Provides a list/dict-like
@@ -66,6 +64,15 @@ class Element(object):
         except IndexError:
             return False
 
+    def iter(self, names=None):
+        """Returns a generator yielding the subelements. If "names" is
+        given, only the subelements with names in it are yielded. The
+        others are skipped without being converted to Element objects.
+        """
+        for node in self._nodes:
+            if names is None or node.tagName in names:
+                yield Element(node)
+
     def toxml(self):
         """Returns the element and all subelements as xml.
         """
@@ -103,6 +110,8 @@ def parse(xml):
     """Parses an xml and returns the Element object of the root element.
     xml may be either a string or a file-alike object.
     """
+    # Imported here because it takes long to import.
+    from xml.dom import minidom
     if isinstance(xml, str):
         dom = minidom.parseString(xml)
     else:
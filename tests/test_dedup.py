@@ -0,0 +1,64 @@
+"""
+Tests of the upload deduplication against the FakeServer.
+
+Run with:
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import scribd
+from scribd.dedup import DedupIndex
+from scribd.fakeserver import FakeServer
+
+
+class DedupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.server.configure_client()
+        self.dir = tempfile.mkdtemp()
+        scribd.dedup_index = DedupIndex(os.path.join(self.dir, 'uploads.db'))
+        self.data = ''.join(chr(i % 251) for i in xrange(10000))
+
+    def tearDown(self):
+        scribd.dedup_index = None
+        shutil.rmtree(self.dir)
+        self.server.stop()
+
+    def uploads(self):
+        return self.server.calls.get('docs.upload', 0)
+
+    def test_repeated_upload(self):
+        doc = scribd.api_user.upload(StringIO(self.data), 'report.pdf')
+        again = scribd.api_user.upload(StringIO(self.data), 'report.pdf')
+        self.assertEqual(again.doc_id, doc.doc_id)
+        self.assertEqual(self.uploads(), 1)
+
+    def test_different_parameters(self):
+        doc = scribd.api_user.upload(StringIO(self.data), 'report.pdf')
+        other = scribd.api_user.upload(StringIO(self.data), 'report.pdf',
+                                       access='private')
+        self.assertNotEqual(other.doc_id, doc.doc_id)
+        other = scribd.api_user.upload(StringIO(self.data), 'report.txt')
+        self.assertNotEqual(other.doc_id, doc.doc_id)
+        self.assertEqual(self.uploads(), 3)
+
+    def test_identical_revision(self):
+        doc = scribd.api_user.upload(StringIO(self.data), 'report.pdf')
+        doc.replace(StringIO(self.data), 'report.pdf')
+        self.assertEqual(self.uploads(), 1)
+        doc.replace(StringIO(self.data[::-1]), 'report.pdf')
+        self.assertEqual(self.uploads(), 2)
+        doc.replace(StringIO(self.data[::-1]), 'report.pdf')
+        self.assertEqual(self.uploads(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Tests of the file downloads against the FakeServer.
+
+Run with:
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import scribd
+from scribd import download
+from scribd.fakeserver import FakeServer
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.server.configure_client()
+        self.dir = tempfile.mkdtemp()
+        self.data = ''.join(chr(i % 251) for i in xrange(10000))
+        self.doc = scribd.api_user.upload(StringIO(self.data), 'report.pdf')
+        self.path = os.path.join(self.dir, 'report.pdf')
+        self.min_part_size = download.MIN_PART_SIZE
+
+    def tearDown(self):
+        download.MIN_PART_SIZE = self.min_part_size
+        shutil.rmtree(self.dir)
+        self.server.stop()
+
+    def read(self, path):
+        file = open(path, 'rb')
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+    def gets(self):
+        # Returns the Range headers of the GET requests.
+        return [range for method, range in self.server.downloads if method == 'GET']
+
+    def test_single_stream(self):
+        self.server.ranges = False
+        self.assertEqual(self.doc.download(self.dir), self.path)
+        self.assertEqual(self.read(self.path), self.data)
+        self.assertEqual(len(self.gets()), 1)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['report.pdf'])
+
+    def test_parallel_ranges(self):
+        download.MIN_PART_SIZE = 1000
+        self.doc.download(self.path, parts=4)
+        self.assertEqual(self.read(self.path), self.data)
+        self.assertEqual(sorted(self.gets()), ['bytes=0-2499', 'bytes=2500-4999',
+                                               'bytes=5000-7499', 'bytes=7500-9999'])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['report.pdf'])
+
+    def test_truncated_body(self):
+        self.server.truncate = 3000
+        self.assertRaises(download.DownloadError, self.doc.download, self.path)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.read(self.path + '.part'), self.data[:3000])
+
+    def test_resume(self):
+        self.server.truncate = 3000
+        self.assertRaises(download.DownloadError, self.doc.download, self.path)
+        self.server.truncate = None
+        del self.server.downloads[:]
+        self.doc.download(self.path)
+        self.assertEqual(self.read(self.path), self.data)
+        self.assertEqual(self.gets(), ['bytes=3000-9999'])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['report.pdf'])
+
+    def test_resume_changed_file(self):
+        self.server.truncate = 3000
+        self.assertRaises(download.DownloadError, self.doc.download, self.path)
+        self.server.truncate = None
+        stored = self.server.store.get(self.doc.doc_id)
+        stored.data = self.data[::-1]
+        self.doc.download(self.path)
+        self.assertEqual(self.read(self.path), stored.data)
+
+    def test_if_range_restarts(self):
+        # The file changes after the validator was read, the server
+        # answers the ranged request with the whole new file.
+        url = self.doc.get_download_url()
+        part = self.path + '.part'
+        file = open(part, 'wb')
+        file.write(self.data[:3000])
+        file.close()
+        old = self.server.store.get(self.doc.doc_id).etag()
+        stored = self.server.store.get(self.doc.doc_id)
+        stored.data = self.data[::-1]
+        download._fetch(url, (5.0, 5.0), old, part, 0, None, True)
+        self.assertEqual(self.read(part), stored.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Tests of the per-process state rebuilt after a fork.
+
+Run with:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+import scribd
+from scribd import forksafe
+from scribd.fakeserver import FakeServer
+
+
+def pooled_sockets():
+    # Returns the local addresses of the idle pooled connections.
+    addresses = set()
+    for conns in scribd.connection_pool._idle.values():
+        for conn in conns:
+            if conn.sock is not None:
+                addresses.add(conn.sock.getsockname())
+    return addresses
+
+
+class ForkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.server.start()
+        self.server.configure_client()
+        scribd.connection_pool.clear()
+
+    def tearDown(self):
+        scribd.connection_pool.clear()
+        self.server.stop()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+    def test_child_uses_own_connection(self):
+        scribd.api_user.all()
+        parent = pooled_sockets()
+        self.assertEqual(len(parent), 1)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child process, report the pooled sockets to the parent.
+            status = 1
+            try:
+                try:
+                    os.close(read_fd)
+                    # Done by the library before using the pool, unless
+                    # os.register_at_fork() did it already.
+                    forksafe.check()
+                    before = pooled_sockets()
+                    scribd.api_user.all()
+                    os.write(write_fd, repr((sorted(before), sorted(pooled_sockets()))))
+                    status = 0
+                except:
+                    sys.excepthook(*sys.exc_info())
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        data = ''
+        while True:
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(read_fd)
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+        before, after = eval(data)
+        # The child starts with an empty pool and opens its own connection.
+        self.assertEqual(before, [])
+        self.assertEqual(len(after), 1)
+        self.assertFalse(set(after) & parent)
+
+        # The parent's connection wasn't closed or used by the child.
+        scribd.api_user.all()
+        self.assertEqual(pooled_sockets(), parent)
+
+
+if __name__ == '__main__':
+    unittest.main()